@@ -1,11 +1,15 @@
+from server.discovery import boot_servers, discover_servers
+from server.backup_coordinator import get_coordinator
 from server.server_manager import ServerManager
-from config.configs import ObsidiaConfigParser
+from server.supervisor import get_supervisor
+from server.shutdown import shutdown_servers
+from server.registry import ServerRegistry
+from config.configs import get_config
 from server.server import ServerListener
+from concurrent.futures import Future
 from web import website
-from typing import Set
 import threading
-import asyncio
-import glob
+import time
 import os
 
 
@@ -18,65 +22,80 @@ class DebugPrintListener:
         threading.Thread(target=self._print_queue).start()
 
     def _print_queue(self):
-        while (self._manager.server_should_be_running()):
-            if (self._listener.has_next()):
-                print(self._listener.next())
+        # blocks until there is a message, and ends once the listener closes with the server
+        for message in self._listener:
+            print(message)
         print("DebugPrintListener closing")
 
 
-class ServerHandler:
-    def __init__(self, server_directory: str):
-        self.server_directory = server_directory
-        self.manager: ServerManager = ServerManager(self.server_directory)
+class ServerLoader:
+    '''Discovers servers and boots them in the background, so the web console can come online straight away.'''
 
-    def start_server(self):
-        self.manager.start_server()
+    def __init__(self, server_dir: str, registry: ServerRegistry, workers: int, start_servers: bool, max_booting: int):
+        self._server_dir = server_dir
+        self._registry = registry
+        self._workers = workers
+        self._start_servers = start_servers
+        self._max_booting = max_booting
+        self._lock = threading.Lock()
+        self._boot: Future = None
+        self._cancelled = False
 
-    def __str__(self):
-        return self.manager.get_name()
+    def start(self):
+        threading.Thread(target=self._load, name="ServerLoader", daemon=True).start()
+
+    def _load(self):
+        managers = discover_servers(self._server_dir, self._registry, self._workers)
+        print(f"Found {len(managers)} servers.")
+        if self._start_servers:
+            with self._lock:
+                if not self._cancelled:
+                    self._boot = boot_servers(managers, self._max_booting)
+
+    def cancel(self):
+        '''Stops booting any servers that haven't been started yet.'''
+        with self._lock:
+            self._cancelled = True
+            if self._boot != None:
+                self._boot.cancel()
 
 
 if __name__ == "__main__":
-    configs = ObsidiaConfigParser(os.path.join("config", "obsidia_website.conf"))
+    configs = get_config(os.path.join("config", "obsidia_website.conf"))
+
+    get_coordinator().configure(configs.get_int("Backup Limits", "max_concurrent_backups"),
+                                configs.get_float("Backup Limits", "max_backup_speed") * 1024 * 1024,
+                                configs.get_float("Backup Limits", "backup_stagger_window") * 60)
 
     server_dir = configs.get("Servers", "directory")
-    server_handlers: Set[ServerHandler] = set()
-    try:
-        for folder in os.listdir(server_dir):
-            path = os.path.join(server_dir, folder)
-            if len(glob.glob(os.path.join(path, "*.jar"))) != 0:
-                try:
-                    server_handlers.add(ServerHandler(path))
-                except FileNotFoundError as ex:
-                    print(f"[WARNING] {ex} Failed for server: {path}")
-                    input("Press enter to continue for other servers.")
-    except FileNotFoundError as e:
+    if not os.path.isdir(server_dir):
         print(f"[ERROR] Cannot reach servers directory ({server_dir}). Did you configure it correctly?")
         input("Press enter to close.")
         raise SystemExit
 
-    if configs.get("Servers", "start_all_servers_on_startup").lower() == "true":
-        for handler in server_handlers:
-            handler.start_server()
-
-    website.start(server_handlers)
-
-    # ctrl-c in the console, shut down all servers that haven't caught it already
-    for handler in server_handlers:
-        handler.manager.stop_server()
-
-    if threading.active_count() > 1:
-        print("Waiting for latent threads to close:")
-        for thread in threading.enumerate():
-            if thread != threading.current_thread():
-                print(f"\t{thread.getName()}")
-        asyncio.run(asyncio.sleep(5))
-
-    if threading.active_count() > 1:
-        print("Some threads remain:")
-        for thread in threading.enumerate():
-            if thread != threading.current_thread():
-                print(f"\t{thread.getName()}")
-        print("Raising SystemExit to attempt to close them.")
-        print("If this doesn't close the terminal, try killing the task I guess.")
-        raise SystemExit
+    # servers show up in the web console as they are found
+    registry = ServerRegistry()
+    loader = ServerLoader(server_dir, registry, configs.get_int("Servers", "discovery_workers"),
+                          configs.get_bool("Servers", "start_all_servers_on_startup"), configs.get_int("Servers", "max_booting_servers"))
+    configs.flush()
+    loader.start()
+
+    website.start(registry)
+
+    # ctrl-c in the console, shut down all servers at once, killing any that won't stop
+    loader.cancel()
+    print("Waiting for servers to close.")
+    shutdown_start = time.monotonic()
+    results = shutdown_servers(registry, configs.get_float("Servers", "stop_timeout"), configs.get_float("Servers", "save_timeout"))
+    for name, (outcome, seconds) in sorted(results.items()):
+        if outcome != "offline":
+            print(f"\t{name}: {outcome} in {seconds:.1f}s")
+    get_supervisor().shutdown(timeout=1)
+    print(f"Servers closed in {time.monotonic() - shutdown_start:.1f}s.")
+
+    # backups and the like would be left half written, so let them finish
+    background = [thread for thread in threading.enumerate() if thread != threading.current_thread() and not thread.daemon]
+    if len(background) > 0:
+        print(f"Waiting for {len(background)} background jobs to finish: {', '.join(thread.name for thread in background)}")
+        for thread in background:
+            thread.join()
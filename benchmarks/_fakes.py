@@ -0,0 +1,61 @@
+'''Helpers for setting up fake servers for the benchmarks (POSIX only, java is replaced with a shell shim).'''
+
+from contextlib import contextmanager
+from typing import Iterator
+import tempfile
+import random
+import sys
+import os
+
+
+FAKE_JAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_java.py")
+
+
+@contextmanager
+def fake_java_on_path() -> Iterator[str]:
+    '''Puts an executable named java on the front of PATH that runs fake_java.py, yields the shim's directory.'''
+    with tempfile.TemporaryDirectory() as bin_dir:
+        shim = os.path.join(bin_dir, "java")
+        with open(shim, "w") as file:
+            file.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_JAVA}" "$@"\n')
+        os.chmod(shim, 0o755)
+        old_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = bin_dir + os.pathsep + old_path
+        try:
+            yield bin_dir
+        finally:
+            os.environ["PATH"] = old_path
+
+
+def make_server_directory(root: str, name: str) -> str:
+    '''Creates a directory that looks enough like a server for ServerManager, returns its path.'''
+    path = os.path.join(root, name)
+    os.makedirs(os.path.join(path, "world"), exist_ok=True)
+    with open(os.path.join(path, "server.jar"), "w") as file:
+        file.write("\n")
+    with open(os.path.join(path, "server.properties"), "w") as file:
+        file.write("level-name=world\nmotd=A Minecraft Server\n")
+    return path
+
+
+def write_fake_log(path: str, size_bytes: int, seed: int = 0) -> int:
+    '''Writes a log of roughly size_bytes resembling world generation spam, returns the number of lines written.'''
+    rng = random.Random(seed)
+    templates = [
+        "[12:{m:02}:{s:02}] [Worker-Main-{w}/INFO]: Preparing spawn area: {p}%",
+        "[12:{m:02}:{s:02}] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running {p}ms or {w} ticks behind",
+        "[12:{m:02}:{s:02}] [Server thread/ERROR]: Couldn't load chunk [{w}, {p}]",
+        "[12:{m:02}:{s:02}] [Server thread/INFO]: Player{w} joined the game",
+        "[12:{m:02}:{s:02}] [Server thread/INFO]: <Player{w}> hello there number {p}",
+        # Paper, Spigot and Bukkit put the level in with the time
+        "[12:{m:02}:{s:02} INFO]: Player{w} left the game",
+    ]
+    written = 0
+    lines = 0
+    with open(path, "w") as file:
+        while written < size_bytes:
+            line = rng.choice(templates).format(m=rng.randrange(60), s=rng.randrange(60), w=rng.randrange(16), p=rng.randrange(100)) + "\n"
+            file.write(line)
+            written += len(line)
+            lines += 1
+    return lines
@@ -0,0 +1,67 @@
+'''
+Measures how fast console events are parsed out of a large log replay.
+
+The log is split into chunks of lines the way ServerRunner reads stdout, and each chunk is fed to ServerEvents.
+For comparison, the same rules are also applied the obvious way: decoding every line and trying every pattern on it.
+Run from the repository root: python -m benchmarks.bench_event_parse [megabytes]
+'''
+
+from benchmarks._fakes import write_fake_log
+from server.events import DEFAULT_RULES, ServerEvents
+from server.server import ServerRunner
+from typing import List
+import tempfile
+import time
+import sys
+import re
+import os
+
+
+def read_chunks(log: str) -> List[List[bytes]]:
+    '''Splits the log into batches of lines, as the runner gets them from stdout.'''
+    chunks = []
+    pending = b""
+    with open(log, "rb") as file:
+        while True:
+            chunk = file.read(ServerRunner._READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            chunks.append([line.strip() for line in lines])
+    return chunks
+
+
+def parse_naively(chunks: List[List[bytes]]) -> int:
+    compiled = [(rule.kind, re.compile(rule.pattern.pattern.decode())) for rule in DEFAULT_RULES]
+    events = 0
+    for chunk in chunks:
+        for raw_line in chunk:
+            line = raw_line.decode(errors="replace")
+            for _, pattern in compiled:
+                if pattern.search(line) != None:
+                    events += 1
+    return events
+
+
+def parse_events(chunks: List[List[bytes]]) -> int:
+    events = ServerEvents()
+    return sum(len(events.feed(chunk)) for chunk in chunks)
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as root:
+        log = os.path.join(root, "replay.log")
+        lines = write_fake_log(log, megabytes * 1024 * 1024)
+        chunks = read_chunks(log)
+    print(f"Replaying {lines:,} lines ({megabytes} MB)")
+    for name, parse in [("every pattern per line", parse_naively), ("ServerEvents", parse_events)]:
+        start = time.perf_counter()
+        found = parse(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<24} {elapsed:7.3f}s {lines / elapsed:>14,.0f} lines/s {found:>12,} events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+'''
+Measures how fast ServerRunner pumps console output to listeners.
+
+A multi-megabyte log is replayed through a fake java process and the time until every line reaches a listener is reported.
+Run from the repository root: python -m benchmarks.bench_log_pump [megabytes]
+'''
+
+from benchmarks._fakes import fake_java_on_path, make_server_directory, write_fake_log
+from server.server import ServerRunner
+import tempfile
+import asyncio
+import time
+import sys
+import os
+
+
+class CountingListener:
+    def __init__(self):
+        self.lines = 0
+        self.ready_at = None
+
+    def update(self, message: str):
+        self.lines += 1
+        if self.ready_at == None and "INFO]: Done (" in message:
+            self.ready_at = time.perf_counter()
+
+
+async def replay(server_directory: str) -> CountingListener:
+    runner = ServerRunner(server_directory)
+    listener = CountingListener()
+    runner.add_listener(listener)
+    task = asyncio.get_running_loop().create_task(runner.start())
+    while not runner.is_ready():
+        if task.done():
+            raise RuntimeError("Fake server exited before becoming ready.")
+        await asyncio.sleep(0.001)
+    runner.stop()
+    await task
+    return listener
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as root, fake_java_on_path():
+        server_directory = make_server_directory(root, "bench")
+        log = os.path.join(root, "replay.log")
+        lines = write_fake_log(log, megabytes * 1024 * 1024)
+        os.environ["OBSIDIA_FAKE_LOG"] = log
+        start = time.perf_counter()
+        listener = asyncio.run(replay(server_directory))
+        elapsed = listener.ready_at - start
+    print(f"Replayed {lines} lines ({megabytes} MB) in {elapsed:.3f}s")
+    print(f"{lines / elapsed:,.0f} lines/s, {megabytes / elapsed:.1f} MB/s, {listener.lines} lines delivered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+'''
+Measures how long the web console takes to get and render the latest log.
+
+Compares reading all of latest.log on every render against LogReader's tail, for a few log sizes.
+Run from the repository root: python -m benchmarks.bench_log_render [megabytes ...]
+'''
+
+from benchmarks._fakes import write_fake_log
+from server.logs import LogReader
+from typing import List
+import tempfile
+import time
+import sys
+import os
+
+
+CONSOLE_LINES = 1000
+RENDERS = 5
+
+
+def make_renderer():
+    '''Returns a function rendering the lines like server_console.html does, plain joining if jinja2 isn't installed.'''
+    try:
+        from jinja2 import Template
+    except ImportError:
+        return lambda logs: "".join(f"<p>{log}</p>" for log in logs)
+    template = Template("{% for log in logs %}<p>{{ log }}</p>{% endfor %}", autoescape=True)
+    return lambda logs: template.render(logs=logs)
+
+
+def read_everything(log_file: str) -> List[str]:
+    '''How the log used to be read.'''
+    with open(log_file) as file:
+        return file.readlines()
+
+
+def time_renders(get_lines, render) -> float:
+    start = time.perf_counter()
+    for _ in range(RENDERS):
+        render(get_lines())
+    return (time.perf_counter() - start) / RENDERS
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 50, 500]
+    render = make_renderer()
+    print(f"{'size':>8} {'read all':>12} {'tail':>12}")
+    for megabytes in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            log_file = os.path.join(root, "latest.log")
+            write_fake_log(log_file, megabytes * 1024 * 1024)
+            reader = LogReader(log_file)
+            everything = time_renders(lambda: read_everything(log_file), render)
+            tail = time_renders(lambda: reader.tail(CONSOLE_LINES)[0], render)
+            reader.close()
+        print(f"{megabytes:>6}MB {everything * 1000:>10.1f}ms {tail * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+'''
+Measures how long it takes to shut down many servers that each take a while to save their world.
+
+Run from the repository root: python -m benchmarks.bench_shutdown [servers] [save seconds]
+'''
+
+from benchmarks._fakes import fake_java_on_path, make_server_directory
+from server.server_manager import ServerManager
+from server.supervisor import get_supervisor
+from server.shutdown import shutdown_servers
+import tempfile
+import time
+import sys
+import os
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    save_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    os.environ["OBSIDIA_FAKE_SAVE_SECONDS"] = str(save_seconds)
+    with tempfile.TemporaryDirectory() as root, fake_java_on_path():
+        managers = [ServerManager(make_server_directory(root, f"bench{i}")) for i in range(count)]
+        for manager in managers:
+            manager.start_server()
+        while not all(manager.server_active() for manager in managers):
+            time.sleep(0.01)
+        start = time.perf_counter()
+        results = shutdown_servers(managers)
+        elapsed = time.perf_counter() - start
+        get_supervisor().shutdown()
+    slowest = max(seconds for _, seconds in results.values())
+    outcomes = sorted(set(outcome for outcome, _ in results.values()))
+    print(f"Shut down {count} servers saving for {save_seconds}s each in {elapsed:.2f}s (slowest {slowest:.2f}s), outcomes: {', '.join(outcomes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''
+Measures how the supervisor scales with the number of servers.
+
+For each server count, fake servers are started and stopped through ServerManager while recording the thread count,
+the console's resident memory, and how long start (until ready) and stop (until the manager reports it is down) take.
+Run from the repository root: python -m benchmarks.bench_supervisor_scaling [count ...]
+'''
+
+from benchmarks._fakes import fake_java_on_path, make_server_directory
+from server.server_manager import ServerManager
+from server.supervisor import ServerSupervisor
+from typing import Callable, List
+import statistics
+import threading
+import tempfile
+import time
+import sys
+
+
+def rss_mb() -> float:
+    '''Resident memory of this process (not the fake servers) in MB, from /proc.'''
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def os_thread_count() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+def wait_all(managers: List[ServerManager], done: Callable[[ServerManager], bool], started: float, timeout: float = 60) -> List[float]:
+    '''Polls until done is true for every manager, returns the latency of each in ms.'''
+    latencies = [None] * len(managers)
+    deadline = time.perf_counter() + timeout
+    while None in latencies:
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Fake servers did not change state in time.")
+        for i, manager in enumerate(managers):
+            if latencies[i] == None and done(manager):
+                latencies[i] = (time.perf_counter() - started) * 1000
+        time.sleep(0.002)
+    return latencies
+
+
+def run(count: int, root: str):
+    supervisor = ServerSupervisor()
+    managers = [ServerManager(make_server_directory(root, f"server{count}-{i}"), supervisor=supervisor) for i in range(count)]
+
+    started = time.perf_counter()
+    for manager in managers:
+        manager.start_server()
+    start_latencies = wait_all(managers, lambda manager: manager.server_active(), started)
+    threads_running = (threading.active_count(), os_thread_count())
+    rss_running = rss_mb()
+
+    started = time.perf_counter()
+    for manager in managers:
+        manager.stop_server()
+    stop_latencies = wait_all(managers, lambda manager: not manager.server_should_be_running(), started)
+    supervisor.shutdown()
+
+    print(f"{count:>7} {threads_running[0]:>8} {threads_running[1]:>8} {rss_running:>8.1f} "
+          f"{statistics.median(start_latencies):>10.1f} {max(start_latencies):>10.1f} "
+          f"{statistics.median(stop_latencies):>10.1f} {max(stop_latencies):>10.1f}")
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 5, 10, 20, 40]
+    print(f"{'servers':>7} {'py thr':>8} {'os thr':>8} {'rss MB':>8} {'start p50':>10} {'start max':>10} {'stop p50':>10} {'stop max':>10}")
+    with tempfile.TemporaryDirectory() as root, fake_java_on_path():
+        for count in counts:
+            run(count, root)
+
+
+if __name__ == "__main__":
+    main()
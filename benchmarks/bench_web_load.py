@@ -0,0 +1,133 @@
+'''
+Measures web console latency under concurrent clients, against a running Obsidia.
+
+Every client logs in, selects the server, then alternates between loading /server and sending a command through
+/server/command. Optionally a number of idle console streams are held open the whole time, like open browser tabs.
+The p50/p99 latency of each endpoint is reported.
+
+Run from the repository root, with Obsidia already running:
+python -m benchmarks.bench_web_load --server MyServer [--url http://127.0.0.1:5000] [--password admin@obsidia]
+    [--clients 20] [--requests 50] [--streams 200] [--command list]
+'''
+
+from urllib.parse import urlencode, urlparse
+from urllib.error import HTTPError
+from typing import Dict, List
+import http.cookiejar
+import urllib.request
+import http.client
+import threading
+import argparse
+import time
+
+
+class Client:
+    '''One browser session, with its own cookies.'''
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.cookies = http.cookiejar.CookieJar()
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def request(self, path: str, form: Dict[str, str] = None) -> float:
+        '''Makes a request (a POST if there is a form), returning how long it took in seconds.'''
+        data = urlencode(form).encode() if form != None else None
+        start = time.perf_counter()
+        try:
+            with self._opener.open(self.url + path, data=data, timeout=30) as response:
+                response.read()
+        except HTTPError as e:
+            if e.code >= 500:
+                raise
+        return time.perf_counter() - start
+
+    def log_in(self, password: str, server: str):
+        self.request("/verify", {"password": password})
+        self.request("/selectserver", {"serverselection": server})
+
+    def cookie_header(self) -> str:
+        return "; ".join(f"{cookie.name}={cookie.value}" for cookie in self.cookies)
+
+
+def hold_stream(client: Client, stop: threading.Event, opened: threading.Semaphore):
+    '''Opens /server/stream and reads from it until stop is set.'''
+    url = urlparse(client.url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    try:
+        connection.request("GET", "/server/stream", headers={"Cookie": client.cookie_header(), "Accept": "text/event-stream"})
+        response = connection.getresponse()
+        opened.release()
+        while not stop.is_set() and response.fp != None:
+            if response.fp.readline() == b"":
+                break
+    except OSError:
+        opened.release()
+    finally:
+        connection.close()
+
+
+def run_client(client: Client, requests: int, command: str, results: Dict[str, List[float]], lock: threading.Lock):
+    page = []
+    commands = []
+    for _ in range(requests):
+        page.append(client.request("/server"))
+        commands.append(client.request("/server/command", {"commandentry": command}))
+    with lock:
+        results["/server"] += page
+        results["/server/command"] += commands
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web console of a running Obsidia.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--password", default="admin@obsidia")
+    parser.add_argument("--server", required=True, help="the name of the server to load, as shown in the server list")
+    parser.add_argument("--clients", type=int, default=20, help="clients making requests at once")
+    parser.add_argument("--requests", type=int, default=50, help="page loads and commands per client")
+    parser.add_argument("--streams", type=int, default=0, help="idle console streams to hold open meanwhile")
+    parser.add_argument("--command", default="list", help="the console command to send")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    opened = threading.Semaphore(0)
+    streams = []
+    for _ in range(args.streams):
+        client = Client(args.url)
+        client.log_in(args.password, args.server)
+        thread = threading.Thread(target=hold_stream, args=(client, stop, opened), daemon=True)
+        thread.start()
+        streams.append(thread)
+    for _ in streams:
+        opened.acquire()
+    print(f"Holding {len(streams)} console streams open.")
+
+    clients = []
+    for _ in range(args.clients):
+        client = Client(args.url)
+        client.log_in(args.password, args.server)
+        clients.append(client)
+    results = {"/server": [], "/server/command": []}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=run_client, args=(client, args.requests, args.command, results, lock)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+
+    total = sum(len(samples) for samples in results.values())
+    print(f"{args.clients} clients made {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} requests/s)")
+    for path, samples in results.items():
+        if len(samples) > 0:
+            print(f"{path:<16} p50 {percentile(samples, 50) * 1000:8.1f}ms   p99 {percentile(samples, 99) * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+'''
+Stand-in for a Minecraft server's java process, used by the benchmarks.
+
+Accepts (and ignores) the arguments that ServerRunner passes to java.
+If OBSIDIA_FAKE_LOG names a file, it is replayed to stdout as fast as possible before the server reports that it is ready.
+Afterwards, console commands are read from stdin until "stop" is received or stdin is closed.
+Saving the world on stop takes OBSIDIA_FAKE_SAVE_SECONDS (default 0), and if OBSIDIA_FAKE_HANG is set the process never exits.
+'''
+
+import shutil
+import time
+import sys
+import os
+
+
+def main():
+    out = sys.stdout.buffer
+    out.write(b"[00:00:00] [Server thread/INFO]: Starting minecraft server version fake\n")
+    replay = os.environ.get("OBSIDIA_FAKE_LOG")
+    if replay:
+        with open(replay, "rb") as log:
+            shutil.copyfileobj(log, out, 1 << 16)
+    out.write(b'[00:00:01] [Server thread/INFO]: Done (1.000s)! For help, type "help"\n')
+    out.flush()
+    for line in sys.stdin:
+        command = line.strip()
+        if command == "stop":
+            break
+        out.write(f"[00:00:02] [Server thread/INFO]: Ran command {command}\n".encode())
+        out.flush()
+    out.write(b"[00:00:03] [Server thread/INFO]: Stopping server\n")
+    out.write(b"[00:00:03] [Server thread/INFO]: Saving chunks for level 'ServerLevel[world]'/minecraft:overworld\n")
+    out.flush()
+    time.sleep(float(os.environ.get("OBSIDIA_FAKE_SAVE_SECONDS", "0")))
+    out.write(b"[00:00:03] [Server thread/INFO]: ThreadedAnvilChunkStorage: All dimensions are saved\n")
+    out.flush()
+    while os.environ.get("OBSIDIA_FAKE_HANG"):
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
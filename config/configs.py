@@ -1,127 +1,230 @@
-from configparser import ConfigParser, DuplicateSectionError
-from typing import Union
-import os
-
-
-class ObsidiaConfigParser:
-    '''
-    Open and interact with a config file.
-
-    Parameters
-    ----------
-    config_file: `str`
-        The config file to read from, will be created if nonexistant
-    '''
-
-    def __init__(self, config_file: str):
-        self._file = os.path.abspath(config_file)
-        self._parser = ConfigParser()
-        exists = self._parser.read(self._file)
-        # create an empty file that will just use defaults
-        if len(exists) == 0:
-            with open(self._file, "w") as file:
-                file.write("\n")
-
-        self._defaults_configs_file = os.path.join("config", "obsidia_defaults.conf")
-        self._defaults_parser = ConfigParser()
-        self._defaults_parser.read(self._defaults_configs_file)
-
-    def read(self, config_file: str):
-        '''Replaces the currently read file with the newly specified file.'''
-        self._file = os.path.abspath(config_file)
-        self._parser.read(self._file)
-
-    def write(self):
-        '''Writes the current config to the current file.'''
-        self._parser.write(open(self._file, "w"), space_around_delimiters=False)
-
-    def get_config_file(self):
-        '''Returns the absolute path of the current config file.'''
-        return self._file
-
-    def get(self, section: str, option: str, return_default: bool = True) -> str:
-        '''
-        Returns a given option in the specified config file.
-
-        Parameters
-        ----------
-        section: `str`
-            The section that the data is under, such as [Settings]
-        option: `str`
-            The actual option name, such as varname in varname=42
-        return_default: `bool`
-            If true, will return the default value if the option does not exist. If true, will return None.
-            If there is no default value, will return None.
-            If the default value is read, it will be written to the config file.
-
-        Return
-        ------
-        The string in the option or default, for the client to parse
-        '''
-        try:
-            value = self._parser.get(section, option, fallback=None)
-        except RuntimeError:  # fallback does not apply to missing sections
-            value = None
-        if value == None and return_default:
-            try:
-                default_value = self._defaults_parser.get(section, option, fallback=None)
-            except RuntimeError:
-                default_value = None
-            if default_value != None:
-                try:
-                    self._parser.add_section(section)
-                except DuplicateSectionError:
-                    pass
-                self._parser.set(section, option, default_value)
-                self.write()
-            return default_value.strip()
-        return value.strip()
-
-    def add_section(self, section: str):
-        '''Add a new section to the config.'''
-        self._parser.add_section(section)
-
-    def remove_section(self, section: str):
-        '''Removes a section and all of its options.'''
-        self._parser.remove_section(section)
-
-    def set_option(self, section: str, option: str, value: Union[str, None]):
-        '''Add a new option to the config, including the value.'''
-        self._parser.set(section, option, value)
-
-
-class MCPropertiesParser:
-    '''
-    Open and interact with a server.properties file.
-
-    Parameters
-    ----------
-    properties_file: `str`
-        The properties file to read from
-    '''
-
-    def __init__(self, properties_file: str):
-        self._file = os.path.abspath(properties_file)
-
-    def get(self, option: str) -> str:
-        '''Read a specified option from the properties file.'''
-        for line in open(self._file, "r"):
-            if line[:len(option)] == option:
-                return line[len(option) + 1:].strip()
-        return None
-
-    def set(self, option: str, value: str):
-        '''
-        Edit a specified option to a new value.
-
-        If the option does not exist, there is no effect.
-        '''
-        full_lines = ""
-        for line in open(self._file, "r"):
-            if line[:len(option)] == option:
-                full_lines += line[:len(option) + 1] + value + "\n"
-            else:
-                full_lines += line
-        file_write = open(self._file, "w")
-        file_write.write(full_lines)
-        file_write.close()
+from server.scheduler import Schedule
+from configparser import ConfigParser, DuplicateSectionError
+from typing import Dict, Tuple, Union
+import threading
+import shutil
+import os
+
+
+# the defaults sit next to this module, so they are found whatever the working directory is
+DEFAULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "obsidia_defaults.conf")
+
+_defaults: ConfigParser = None
+_defaults_lock = threading.Lock()
+
+
+def get_defaults() -> ConfigParser:
+    '''Returns the default configs, read once per process.'''
+    global _defaults
+    with _defaults_lock:
+        if _defaults == None:
+            _defaults = ConfigParser()
+            _defaults.read(DEFAULTS_FILE)
+        return _defaults
+
+
+class ObsidiaConfigParser:
+    '''
+    Open and interact with a config file.
+
+    The file is read once, and only read again by reload_if_changed when it has been modified since.
+    Changes (including defaults filled in for missing options) are kept in memory until flush or write, which replace the file
+    in one step, so nothing reading the file ever sees it half written.
+    Use get_config to share one parser per file across the process. All of the methods are safe to call from any thread.
+
+    Parameters
+    ----------
+    config_file: `str`
+        The config file to read from, will be created if nonexistant
+    '''
+
+    def __init__(self, config_file: str):
+        self._lock = threading.RLock()
+        self._file = os.path.abspath(config_file)
+        self._parser = ConfigParser()
+        self._dirty = False
+        self._stamp: Tuple[int, int] = None
+        self._defaults_parser = get_defaults()
+        with self._lock:
+            if not os.path.exists(self._file):
+                # create an empty file that will just use defaults
+                self.write()
+            self._load()
+
+    def _load(self):
+        '''Reads the file from scratch, must hold the lock.'''
+        parser = ConfigParser()
+        parser.read(self._file)
+        self._parser = parser
+        self._dirty = False
+        self._stamp = self._file_stamp()
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        '''The modification time and size of the file, or None if it doesn't exist.'''
+        try:
+            stat = os.stat(self._file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def read(self, config_file: str):
+        '''Replaces the currently read file with the newly specified file.'''
+        with self._lock:
+            self._file = os.path.abspath(config_file)
+            self._load()
+
+    def reload_if_changed(self) -> bool:
+        '''
+        Reads the file again if it has been modified since it was last read or written, returning true if it was.
+
+        Unsaved changes are discarded when the file is read again.
+        '''
+        with self._lock:
+            if self._file_stamp() == self._stamp:
+                return False
+            self._load()
+            return True
+
+    def write(self):
+        '''Writes the current config to the current file, replacing it in one step.'''
+        with self._lock:
+            temp_file = f"{self._file}.{os.getpid()}.tmp"
+            try:
+                with open(temp_file, "w") as file:
+                    self._parser.write(file, space_around_delimiters=False)
+                if os.path.exists(self._file):
+                    shutil.copymode(self._file, temp_file)
+                os.replace(temp_file, self._file)
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            self._dirty = False
+            self._stamp = self._file_stamp()
+
+    def flush(self):
+        '''Writes the config to its file if anything has changed since it was read or written, otherwise does nothing.'''
+        with self._lock:
+            if self._dirty:
+                self.write()
+
+    def get_config_file(self):
+        '''Returns the absolute path of the current config file.'''
+        return self._file
+
+    def get(self, section: str, option: str, return_default: bool = True) -> str:
+        '''
+        Returns a given option in the specified config file.
+
+        Parameters
+        ----------
+        section: `str`
+            The section that the data is under, such as [Settings]
+        option: `str`
+            The actual option name, such as varname in varname=42
+        return_default: `bool`
+            If true, will return the default value if the option does not exist. If true, will return None.
+            If there is no default value, will return None.
+            If the default value is read, it will be added to the config, and written to the file on the next flush.
+
+        Return
+        ------
+        The string in the option or default, for the client to parse
+        '''
+        with self._lock:
+            value = self._parser.get(section, option, fallback=None)
+            if value == None and return_default:
+                value = self._defaults_parser.get(section, option, fallback=None)
+                if value != None:
+                    try:
+                        self._parser.add_section(section)
+                    except DuplicateSectionError:
+                        pass
+                    self._parser.set(section, option, value)
+                    self._dirty = True
+        return value.strip() if value != None else None
+
+    def get_bool(self, section: str, option: str) -> bool:
+        '''Returns an option (or its default) as a bool, true only if it is "true" in any case.'''
+        return self.get(section, option).lower() == "true"
+
+    def get_int(self, section: str, option: str) -> int:
+        '''Returns an option (or its default) as an int, raises ValueError if it isn't one.'''
+        return int(self.get(section, option))
+
+    def get_float(self, section: str, option: str) -> float:
+        '''Returns an option (or its default) as a float, raises ValueError if it isn't one.'''
+        return float(self.get(section, option))
+
+    def get_schedule(self, section: str, option: str) -> Schedule:
+        '''Returns an option (or its default) as a Schedule, parsed from a SMTWRFD HHMM timestamp.'''
+        return Schedule(self.get(section, option))
+
+    def add_section(self, section: str):
+        '''Add a new section to the config.'''
+        with self._lock:
+            self._parser.add_section(section)
+            self._dirty = True
+
+    def remove_section(self, section: str):
+        '''Removes a section and all of its options.'''
+        with self._lock:
+            self._parser.remove_section(section)
+            self._dirty = True
+
+    def set_option(self, section: str, option: str, value: Union[str, None]):
+        '''Add a new option to the config, including the value.'''
+        with self._lock:
+            self._parser.set(section, option, value)
+            self._dirty = True
+
+
+_configs: Dict[str, ObsidiaConfigParser] = {}
+_configs_lock = threading.Lock()
+
+
+def get_config(config_file: str) -> ObsidiaConfigParser:
+    '''Returns the parser for a config file shared by the whole process, reading the file the first time.'''
+    path = os.path.normcase(os.path.abspath(config_file))
+    with _configs_lock:
+        config = _configs.get(path)
+        if config == None:
+            config = _configs[path] = ObsidiaConfigParser(path)
+        return config
+
+
+class MCPropertiesParser:
+    '''
+    Open and interact with a server.properties file.
+
+    Parameters
+    ----------
+    properties_file: `str`
+        The properties file to read from
+    '''
+
+    def __init__(self, properties_file: str):
+        self._file = os.path.abspath(properties_file)
+
+    def get(self, option: str) -> str:
+        '''Read a specified option from the properties file.'''
+        for line in open(self._file, "r"):
+            if line[:len(option)] == option:
+                return line[len(option) + 1:].strip()
+        return None
+
+    def set(self, option: str, value: str):
+        '''
+        Edit a specified option to a new value.
+
+        If the option does not exist, there is no effect.
+        '''
+        full_lines = ""
+        for line in open(self._file, "r"):
+            if line[:len(option)] == option:
+                full_lines += line[:len(option) + 1] + value + "\n"
+            else:
+                full_lines += line
+        file_write = open(self._file, "w")
+        file_write.write(full_lines)
+        file_write.close()
@@ -0,0 +1,100 @@
+from server.backups import BackupJob
+from contextlib import contextmanager
+from typing import Dict, Iterator
+import threading
+import zlib
+import time
+
+
+class BackupCoordinator:
+    '''
+    Coordinates backups across every server on the host, so that they don't all fight over the disk at once.
+
+    Parameters
+    ----------
+    max_concurrent: `int`
+        How many backups may run at once, 0 for no limit
+    max_bytes_per_second: `float`
+        The most bytes per second each backup may read or write, 0 for no limit
+    stagger_window: `float`
+        Scheduled backups are delayed by up to this many seconds, spreading out servers scheduled for the same time
+    '''
+
+    def __init__(self, max_concurrent: int = 0, max_bytes_per_second: float = 0, stagger_window: float = 0):
+        self._condition = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        self.configure(max_concurrent, max_bytes_per_second, stagger_window)
+        self._completed = 0
+        self._queue_seconds_total = 0.0
+        self._queue_seconds_max = 0.0
+        self._copy_seconds_total = 0.0
+        self._copy_seconds_max = 0.0
+        self._bytes_total = 0
+
+    def configure(self, max_concurrent: int, max_bytes_per_second: float, stagger_window: float):
+        '''Changes the limits, backups that are already running keep the speed limit they started with.'''
+        with self._condition:
+            self.max_concurrent = max_concurrent
+            self.max_bytes_per_second = max_bytes_per_second
+            self.stagger_window = stagger_window
+            self._condition.notify_all()
+
+    def stagger_delay(self, key: str) -> float:
+        '''Returns how many seconds to delay a scheduled backup, the same every time for a given key (e.g. a server directory).'''
+        if self.stagger_window <= 0:
+            return 0
+        return zlib.crc32(key.encode()) % int(self.stagger_window * 1000) / 1000
+
+    @contextmanager
+    def slot(self, job: BackupJob) -> Iterator[BackupJob]:
+        '''Waits until the backup is allowed to run, applying the speed limit to the job while it runs.'''
+        queued_at = time.monotonic()
+        with self._condition:
+            self._queued += 1
+            while self.max_concurrent > 0 and self._running >= self.max_concurrent:
+                self._condition.wait()
+            self._queued -= 1
+            self._running += 1
+            job.rate_limit = self.max_bytes_per_second
+        started_at = time.monotonic()
+        try:
+            yield job
+        finally:
+            finished_at = time.monotonic()
+            with self._condition:
+                self._running -= 1
+                self._completed += 1
+                self._queue_seconds_total += started_at - queued_at
+                self._queue_seconds_max = max(self._queue_seconds_max, started_at - queued_at)
+                self._copy_seconds_total += finished_at - started_at
+                self._copy_seconds_max = max(self._copy_seconds_max, finished_at - started_at)
+                self._bytes_total += job.bytes_done
+                self._condition.notify()
+
+    def metrics(self) -> Dict:
+        '''Returns counts of running and queued backups, and how long finished backups spent queued versus copying.'''
+        with self._condition:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "completed": self._completed,
+                "queue_seconds_total": self._queue_seconds_total,
+                "queue_seconds_max": self._queue_seconds_max,
+                "copy_seconds_total": self._copy_seconds_total,
+                "copy_seconds_max": self._copy_seconds_max,
+                "bytes_total": self._bytes_total,
+            }
+
+
+_coordinator: BackupCoordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator() -> BackupCoordinator:
+    '''Returns the coordinator shared by every server in this process (with no limits until configured).'''
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator == None:
+            _coordinator = BackupCoordinator()
+        return _coordinator
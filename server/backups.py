@@ -0,0 +1,757 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple
+import collections
+import functools
+import threading
+import hashlib
+import fnmatch
+import tarfile
+import shutil
+import gzip
+import lzma
+import json
+import mmap
+import time
+import uuid
+import zlib
+import os
+
+
+# files that are never backed up, the server holds them open
+IGNORED_PATTERNS = ["*.lock"]
+
+# in chunked backups, region files are replaced by a manifest of this name (e.g. r.0.0.mca.chunks)
+REGION_SUFFIX = ".mca"
+CHUNK_MANIFEST_SUFFIX = ".chunks"
+
+# region files start with a table of chunk locations and a table of chunk timestamps, each one sector long
+_SECTOR_SIZE = 4096
+_HEADER_SIZE = 2 * _SECTOR_SIZE
+_CHUNKS_PER_REGION = 1024
+
+# archive backups are named <timestamp><extension>, the value of archive_format picks the extension
+ARCHIVE_FORMATS = {"gz": ".tar.gz", "xz": ".tar.xz"}
+
+# archives are compressed in independent blocks of this size, so that blocks can be compressed in parallel
+_ARCHIVE_BLOCK_SIZE = 4 * 1024 * 1024
+
+# when a backup's speed is limited, files are copied in blocks of this size
+_THROTTLED_BLOCK_SIZE = 1024 * 1024
+
+# files are hashed on this many threads, both while backing up and when verifying
+_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# files at least this large are hashed through a memory map rather than read into memory
+_MMAP_THRESHOLD = 1024 * 1024
+
+# details of backups that can't be read from the backup itself cheaply (like an archive's uncompressed size) are kept here
+INFO_DIRECTORY = ".info"
+# the manifest of every file in a backup is kept in the info directory as well, but in its own file, since it can be large and
+# is only needed to make the next backup or verify this one (the info is read every time a backup is shown)
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class BackupJob:
+    '''
+    Tracks a backup (or verification of one) running in the background.
+
+    The copy functions report progress through advance, which is safe to call from any thread.
+
+    Parameters
+    ----------
+    kind: `str`
+        What the job does, "backup" or "verify"
+
+    Attributes
+    ----------
+    job_id: `str`
+        A unique ID for the job
+    state: `str`
+        One of "queued", "running", "completed", or "failed"
+    backup: `str`
+        The name of the backup being made or verified, once known
+    error: `str`
+        Why the job failed, if it did
+    result: `dict`
+        What the job found, for verify jobs (see verify_backup)
+    rate_limit: `float`
+        The most bytes per second the backup may read or write, 0 for no limit
+    '''
+
+    def __init__(self, kind: str = "backup"):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = "queued"
+        self.backup: str = None
+        self.error: str = None
+        self.result: Dict = None
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.created_at = time.time()
+        self.started_at: float = None
+        self.finished_at: float = None
+        self.rate_limit = 0
+        self._throttled_bytes = 0
+        self._throttle_start: float = None
+        self._lock = threading.Lock()
+
+    def start(self, files_total: int, bytes_total: int):
+        '''Marks the job as running with the given amount of work to do.'''
+        with self._lock:
+            self.files_total = files_total
+            self.bytes_total = bytes_total
+            self.started_at = time.time()
+            self._throttle_start = time.monotonic()
+            self.state = "running"
+
+    def advance(self, files: int = 0, nbytes: int = 0):
+        '''Records that some files and bytes have been backed up.'''
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+
+    def throttle(self, nbytes: int):
+        '''Records bytes read or written, sleeping as needed to keep the backup under its rate limit.'''
+        if self.rate_limit <= 0:
+            return
+        with self._lock:
+            self._throttled_bytes += nbytes
+            delay = self._throttle_start + self._throttled_bytes / self.rate_limit - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def finish(self, error: str = None):
+        '''Marks the job as completed, or failed if there is an error.'''
+        with self._lock:
+            self.error = error
+            self.state = "failed" if error != None else "completed"
+            self.finished_at = time.time()
+
+    def is_finished(self) -> bool:
+        return self.state in ("completed", "failed")
+
+    def eta(self) -> float:
+        '''Returns the estimated seconds until the job finishes, or None if it can't be estimated yet.'''
+        with self._lock:
+            if self.state != "running" or self.bytes_done == 0:
+                return None
+            rate = self.bytes_done / max(time.time() - self.started_at, 0.001)
+            return max(self.bytes_total - self.bytes_done, 0) / rate
+
+    def to_dict(self) -> Dict:
+        '''Returns the job's progress as a dict, suitable for JSON.'''
+        eta = self.eta()
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "state": self.state,
+                "backup": self.backup,
+                "error": self.error,
+                "result": self.result,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "eta": eta,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class _NoProgress:
+    rate_limit = 0
+
+    def start(self, files_total: int, bytes_total: int):
+        pass
+
+    def advance(self, files: int = 0, nbytes: int = 0):
+        pass
+
+    def throttle(self, nbytes: int):
+        pass
+
+
+_NO_PROGRESS = _NoProgress()
+
+
+def hash_file(path: str) -> str:
+    '''Returns the SHA-256 of a file, memory mapping large files so they aren't read into memory.'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size >= _MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class FileManifest:
+    '''
+    Records the size and hash of every file in a backup, hashing on a thread pool while the backup carries on.
+
+    Files hard linked from the previous backup reuse the previous manifest's hash instead of being read again.
+    Use as a context manager so the thread pool is always shut down.
+
+    Parameters
+    ----------
+    root: `str`
+        The directory of the backup, which added files are recorded relative to
+    previous: `dict`
+        The manifest of the previous backup, if any (see read_backup_manifest)
+    '''
+
+    def __init__(self, root: str, previous: Dict = None):
+        self._root = root
+        self._previous: Dict = previous or {}
+        self._entries: Dict[str, list] = {}
+        self._executor = ThreadPoolExecutor(_HASH_WORKERS, thread_name_prefix="BackupHash")
+
+    def __enter__(self) -> "FileManifest":
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+
+    def add(self, backup_file: str, previous_file: str = None):
+        '''Records a file that has been written to the backup, previous_file is where it came from in the previous backup.'''
+        key = os.path.relpath(backup_file, self._root).replace(os.sep, "/")
+        stat = os.stat(backup_file)
+        previous = self._previous.get(key)
+        if previous != None and previous_file != None and previous[0] == stat.st_size:
+            try:
+                if os.path.samestat(os.stat(previous_file), stat):  # hard linked, so the data can't differ
+                    self._entries[key] = previous
+                    return
+            except OSError:
+                pass
+        self._entries[key] = [stat.st_size, self._executor.submit(hash_file, backup_file)]
+
+    def add_source(self, key: str, source_file: str, size: int):
+        '''Records a file by hashing its source, for backups (like archives) that files can't be read back from cheaply.'''
+        self._entries[key] = [size, self._executor.submit(hash_file, source_file)]
+
+    def to_dict(self) -> Dict:
+        '''Waits for hashing to finish, returning the manifest to be stored with write_backup_manifest.'''
+        return {key: [size, digest.result() if isinstance(digest, Future) else digest] for key, (size, digest) in self._entries.items()}
+
+
+class _NoManifest:
+    def add(self, backup_file: str, previous_file: str = None):
+        pass
+
+    def add_source(self, key: str, source_file: str, size: int):
+        pass
+
+
+_NO_MANIFEST = _NoManifest()
+
+
+def measure(source: str) -> Tuple[int, int]:
+    '''Returns the number of files and total bytes in source that would be backed up.'''
+    files = 0
+    nbytes = 0
+    for root, dirs, names in os.walk(source):
+        for name in names:
+            if not _is_ignored(name):
+                try:
+                    nbytes += os.path.getsize(os.path.join(root, name))
+                    files += 1
+                except OSError:
+                    pass
+    return files, nbytes
+
+
+def backup_timestamp(name: str) -> int:
+    '''Returns the creation timestamp of a backup made automatically, or None if the name is not a timestamp.'''
+    for extension in ARCHIVE_FORMATS.values():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    try:
+        return int(name)
+    except ValueError:
+        return None
+
+
+def is_archive(backup_path: str) -> bool:
+    '''Returns true if the backup is an archive rather than a directory.'''
+    return any(backup_path.endswith(extension) for extension in ARCHIVE_FORMATS.values()) and os.path.isfile(backup_path)
+
+
+def read_backup_info(backup_directory: str, backup: str) -> Dict:
+    '''Returns the recorded details of a backup, or an empty dict if none were recorded.'''
+    try:
+        with open(os.path.join(backup_directory, INFO_DIRECTORY, backup + ".json"), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_backup_info(backup_directory: str, backup: str, info: Dict):
+    '''Records details of a backup, to be read by read_backup_info.'''
+    os.makedirs(os.path.join(backup_directory, INFO_DIRECTORY), exist_ok=True)
+    with open(os.path.join(backup_directory, INFO_DIRECTORY, backup + ".json"), "w") as file:
+        json.dump(info, file)
+
+
+def read_backup_manifest(backup_directory: str, backup: str) -> Dict:
+    '''Returns the size and hash of every file in a backup, as {path: [size, sha256]}, or None if no manifest was recorded.'''
+    try:
+        with open(os.path.join(backup_directory, INFO_DIRECTORY, backup + MANIFEST_SUFFIX), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_backup_manifest(backup_directory: str, backup: str, manifest: Dict):
+    '''Records the manifest of a backup (see FileManifest.to_dict), to be read by read_backup_manifest.'''
+    os.makedirs(os.path.join(backup_directory, INFO_DIRECTORY), exist_ok=True)
+    with open(os.path.join(backup_directory, INFO_DIRECTORY, backup + MANIFEST_SUFFIX), "w") as file:
+        json.dump(manifest, file)
+
+
+def delete_backup(backup_directory: str, backup: str):
+    '''Deletes a backup (directory or archive) and its recorded details.'''
+    path = os.path.join(backup_directory, backup)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+    for suffix in [".json", MANIFEST_SUFFIX]:
+        try:
+            os.remove(os.path.join(backup_directory, INFO_DIRECTORY, backup + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def timestamped_backups(backups: List[str]) -> List[str]:
+    '''Returns the backups that were made automatically, oldest first.'''
+    return sorted((backup for backup in backups if backup_timestamp(backup) != None), key=backup_timestamp)
+
+
+def _is_ignored(name: str) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORED_PATTERNS)
+
+
+def _copy_file(source_file: str, destination_file: str, progress: BackupJob = _NO_PROGRESS):
+    '''Copies a file and its metadata, in blocks if the backup's speed is limited so that the limit applies within large files.'''
+    if progress.rate_limit <= 0:
+        shutil.copy2(source_file, destination_file)
+        progress.advance(1, os.path.getsize(destination_file))
+        return
+    with open(source_file, "rb") as source, open(destination_file, "wb") as destination:
+        while True:
+            block = source.read(_THROTTLED_BLOCK_SIZE)
+            if not block:
+                break
+            destination.write(block)
+            progress.advance(0, len(block))
+            progress.throttle(2 * len(block))  # read and written
+    shutil.copystat(source_file, destination_file)
+    progress.advance(1, 0)
+
+
+def copy_full(source: str, destination: str, progress: BackupJob = _NO_PROGRESS, file_manifest: FileManifest = _NO_MANIFEST):
+    '''Copies every file from source to destination.'''
+    def copy_function(source_file: str, destination_file: str):
+        _copy_file(source_file, destination_file, progress)
+        file_manifest.add(destination_file)
+    shutil.copytree(source, destination, ignore=shutil.ignore_patterns(*IGNORED_PATTERNS), copy_function=copy_function)
+
+
+def _walk_files(source: str, destination: str, previous: str = None) -> Iterable[tuple]:
+    '''
+    Yields (source file, destination file, previous file) for every file in source that should be backed up.
+
+    Destination directories are created along the way, previous is None if there is no previous snapshot.
+    '''
+    for root, dirs, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        destination_root = os.path.normpath(os.path.join(destination, relative))
+        previous_root = os.path.normpath(os.path.join(previous, relative)) if previous != None else None
+        os.makedirs(destination_root, exist_ok=True)
+        shutil.copystat(root, destination_root)
+        for name in files:
+            if not _is_ignored(name):
+                previous_file = os.path.join(previous_root, name) if previous_root != None else None
+                yield os.path.join(root, name), os.path.join(destination_root, name), previous_file
+
+
+def copy_incremental(source: str, destination: str, previous: str = None, progress: BackupJob = _NO_PROGRESS,
+                     file_manifest: FileManifest = _NO_MANIFEST):
+    '''
+    Copies source to destination, hard linking files from the previous snapshot if they are unchanged.
+
+    A file is unchanged if its size and modification time match the previous snapshot's copy.
+    Hard links share data rather than referring to the previous snapshot, so every snapshot can be restored or deleted on its own.
+    If linking fails (e.g. the filesystem doesn't support it), the file is copied instead.
+    '''
+    for source_file, destination_file, previous_file in _walk_files(source, destination, previous):
+        _copy_or_link(source_file, destination_file, previous_file, progress)
+        file_manifest.add(destination_file, previous_file)
+
+
+def copy_chunked(source: str, destination: str, chunk_store: str, previous: str = None, progress: BackupJob = _NO_PROGRESS,
+                 file_manifest: FileManifest = _NO_MANIFEST):
+    '''
+    Copies source to destination like copy_incremental, except that region files are split into chunks.
+
+    Each chunk is stored once in chunk_store, named by the hash of its contents.
+    The snapshot gets a manifest in place of the region file, listing each chunk's location, timestamp and hash.
+    Chunks whose location and timestamp match the previous snapshot's manifest aren't read again.
+    Files that aren't valid region files are copied as normal.
+    '''
+    for source_file, destination_file, previous_file in _walk_files(source, destination, previous):
+        if source_file.endswith(REGION_SUFFIX):
+            previous_manifest = previous_file + CHUNK_MANIFEST_SUFFIX if previous_file != None else None
+            if _store_region(source_file, destination_file + CHUNK_MANIFEST_SUFFIX, chunk_store, previous_manifest, progress):
+                progress.advance(1, os.path.getsize(source_file))
+                file_manifest.add(destination_file + CHUNK_MANIFEST_SUFFIX, previous_manifest)
+                continue
+        _copy_or_link(source_file, destination_file, previous_file, progress)
+        file_manifest.add(destination_file, previous_file)
+
+
+def _copy_or_link(source_file: str, destination_file: str, previous_file: str = None, progress: BackupJob = _NO_PROGRESS):
+    if previous_file != None and _link_if_unchanged(source_file, previous_file, destination_file):
+        progress.advance(1, os.path.getsize(destination_file))
+    else:
+        _copy_file(source_file, destination_file, progress)
+
+
+def _link_if_unchanged(source_file: str, previous_file: str, destination_file: str) -> bool:
+    try:
+        current = os.stat(source_file)
+        previous = os.stat(previous_file)
+        if current.st_size != previous.st_size or current.st_mtime_ns != previous.st_mtime_ns:
+            return False
+        os.link(previous_file, destination_file)
+    except OSError:
+        return False
+    return True
+
+
+def _read_manifest(manifest_file: str) -> Dict:
+    if manifest_file == None:
+        return None
+    try:
+        with open(manifest_file, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_region(region_file: str, manifest_file: str, chunk_store: str, previous_manifest: str = None,
+                  progress: BackupJob = _NO_PROGRESS) -> bool:
+    '''Stores a region file's chunks and writes its manifest, returns false if it isn't a region file.'''
+    stat = os.stat(region_file)
+    if stat.st_size < _HEADER_SIZE:
+        return False
+    previous = _read_manifest(previous_manifest)
+    if previous != None and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        try:
+            os.link(previous_manifest, manifest_file)
+            return True
+        except OSError:
+            pass
+    chunks = []
+    with open(region_file, "rb") as region:
+        header = region.read(_HEADER_SIZE)
+        progress.throttle(_HEADER_SIZE)
+        for i in range(_CHUNKS_PER_REGION):
+            location = int.from_bytes(header[i * 4:i * 4 + 4], "big")
+            timestamp = int.from_bytes(header[_SECTOR_SIZE + i * 4:_SECTOR_SIZE + i * 4 + 4], "big")
+            if location == 0:
+                chunks.append(None)
+                continue
+            if previous != None:
+                entry = previous["chunks"][i]
+                if entry != None and entry[0] == location and entry[1] == timestamp:
+                    chunks.append(entry)
+                    continue
+            # a chunk is a 4 byte length followed by that many bytes (compression type and data)
+            region.seek((location >> 8) * _SECTOR_SIZE)
+            length_bytes = region.read(4)
+            length = int.from_bytes(length_bytes, "big")
+            data = region.read(length)
+            progress.throttle(length)
+            if length == 0 or len(data) != length:  # points past the end of the file, the game treats it as missing too
+                chunks.append(None)
+                continue
+            chunks.append([location, timestamp, _store_chunk(chunk_store, length_bytes + data)])
+    with open(manifest_file, "w") as file:
+        json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "chunks": chunks}, file, separators=(",", ":"))
+    return True
+
+
+def _chunk_path(chunk_store: str, digest: str) -> str:
+    return os.path.join(chunk_store, digest[:2], digest)
+
+
+def _store_chunk(chunk_store: str, data: bytes) -> str:
+    '''Writes a chunk to the store if it isn't there already, returns its hash.'''
+    digest = hashlib.sha256(data).hexdigest()
+    path = _chunk_path(chunk_store, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+    return digest
+
+
+def _rebuild_region(manifest_file: str, region_file: str, chunk_store: str):
+    '''Writes a region file from a chunk manifest, with chunks packed one after another.'''
+    manifest = _read_manifest(manifest_file)
+    if manifest == None:
+        raise ValueError(f"Unreadable chunk manifest: {manifest_file}")
+    locations = bytearray(_SECTOR_SIZE)
+    timestamps = bytearray(_SECTOR_SIZE)
+    sector = _HEADER_SIZE // _SECTOR_SIZE
+    with open(region_file, "wb") as region:
+        region.seek(_HEADER_SIZE)
+        for i, entry in enumerate(manifest["chunks"]):
+            if entry == None:
+                continue
+            with open(_chunk_path(chunk_store, entry[2]), "rb") as chunk:
+                data = chunk.read()
+            sectors = -(-len(data) // _SECTOR_SIZE)
+            locations[i * 4:i * 4 + 4] = ((sector << 8) | sectors).to_bytes(4, "big")
+            timestamps[i * 4:i * 4 + 4] = entry[1].to_bytes(4, "big")
+            region.write(data + bytes(sectors * _SECTOR_SIZE - len(data)))
+            sector += sectors
+        region.seek(0)
+        region.write(locations)
+        region.write(timestamps)
+
+
+def _compress_block(archive_format: str, level: int, block: bytes) -> bytes:
+    if archive_format == "xz":
+        return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+    return gzip.compress(block, compresslevel=level, mtime=0)
+
+
+class _BlockCompressor:
+    '''
+    A writable file that compresses what is written to it in fixed size blocks on an executor.
+
+    Blocks are written to the output in order as they finish, each as a complete gzip member or xz stream.
+    Concatenated members are still one valid .gz/.xz file, so the result can be read by tarfile and other tools as normal.
+    '''
+
+    def __init__(self, output, executor: Executor, compress: Callable[[bytes], bytes], max_pending: int):
+        self._output = output
+        self._executor = executor
+        self._compress = compress
+        self._max_pending = max_pending
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= _ARCHIVE_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:_ARCHIVE_BLOCK_SIZE]))
+            del self._buffer[:_ARCHIVE_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self._pending.append(self._executor.submit(self._compress, block))
+        # don't let compressed blocks pile up in memory if the disk is slower than the workers
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self._output.write(compressed)
+        self.bytes_out += len(compressed)
+
+    def close(self):
+        if len(self._buffer) > 0:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while len(self._pending) > 0:
+            self._write_next()
+
+
+def archive_world(source: str, archive: str, archive_format: str = "gz", level: int = 6, workers: int = 0,
+                  progress: BackupJob = _NO_PROGRESS, file_manifest: FileManifest = _NO_MANIFEST) -> Dict:
+    '''
+    Streams source into a compressed tar archive, without staging a copy first.
+
+    Blocks of the archive are compressed in parallel on a pool of worker processes (0 workers uses one per core).
+    The archive is written under a temporary name and renamed once complete.
+
+    Return
+    ------
+    A dict of the uncompressed "bytes" and compressed "stored_bytes" of the archive
+    '''
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    partial = os.path.join(os.path.dirname(archive), "." + os.path.basename(archive) + ".partial")
+    compress = functools.partial(_compress_block, archive_format, level)
+
+    def exclude_ignored(member: tarfile.TarInfo) -> tarfile.TarInfo:
+        if _is_ignored(os.path.basename(member.name)):
+            return None
+        if member.isfile():
+            progress.advance(1, member.size)
+            progress.throttle(member.size)
+            file_manifest.add_source(member.name, os.path.join(source, member.name), member.size)
+        return member
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor, open(partial, "wb") as output:
+            compressor = _BlockCompressor(output, executor, compress, workers * 2)
+            with tarfile.open(fileobj=compressor, mode="w|") as tar:
+                for name in sorted(os.listdir(source)):
+                    tar.add(os.path.join(source, name), arcname=name, filter=exclude_ignored)
+            compressor.close()
+        os.replace(partial, archive)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return {"bytes": compressor.bytes_in, "stored_bytes": compressor.bytes_out}
+
+
+def _extract_archive(archive: str, destination: str):
+    os.makedirs(destination)
+    with tarfile.open(archive, "r:*") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(destination, filter="data")
+        else:
+            tar.extractall(destination)
+
+
+def restore_snapshot(snapshot: str, destination: str, chunk_store: str):
+    '''Copies a backup made by any of the backup modes to destination, rebuilding region files from chunk manifests.'''
+    if is_archive(snapshot):
+        _extract_archive(snapshot, destination)
+        return
+
+    def copy_function(source_file: str, destination_file: str):
+        if source_file.endswith(REGION_SUFFIX + CHUNK_MANIFEST_SUFFIX):
+            _rebuild_region(source_file, destination_file[:-len(CHUNK_MANIFEST_SUFFIX)], chunk_store)
+        else:
+            shutil.copy2(source_file, destination_file)
+    shutil.copytree(snapshot, destination, copy_function=copy_function)
+
+
+def collect_chunks(chunk_store: str, snapshots: List[str]):
+    '''Deletes chunks from the store that aren't referenced by any of the given snapshots.'''
+    referenced = set()
+    for snapshot in snapshots:
+        for root, dirs, files in os.walk(snapshot):
+            for name in files:
+                if name.endswith(REGION_SUFFIX + CHUNK_MANIFEST_SUFFIX):
+                    manifest = _read_manifest(os.path.join(root, name))
+                    if manifest == None:
+                        continue
+                    referenced.update(entry[2] for entry in manifest["chunks"] if entry != None)
+    for root, dirs, files in os.walk(chunk_store):
+        for name in files:
+            if name not in referenced:
+                os.remove(os.path.join(root, name))
+
+
+def verify_backup(backup_path: str, files: Dict, chunk_store: str, progress: BackupJob = _NO_PROGRESS) -> Dict:
+    '''
+    Checks a backup against its file manifest (see read_backup_manifest), re-hashing files in parallel.
+
+    For chunked backups, the chunks that region manifests refer to are checked against their hashes as well.
+
+    Return
+    ------
+    A dict of the number of files "checked", and lists of "missing" and "corrupt" files (chunks are listed as chunk:<hash>)
+    '''
+    if files == None:
+        raise ValueError("Backup has no manifest to verify against (it was made before manifests were recorded).")
+    progress.start(len(files), sum(size for size, _ in files.values()))
+    if is_archive(backup_path):
+        missing, corrupt = _verify_archive(backup_path, files, progress)
+    else:
+        missing, corrupt = _verify_directory(backup_path, files, chunk_store, progress)
+    return {"checked": len(files), "missing": sorted(missing), "corrupt": sorted(corrupt)}
+
+
+def _check_file(path: str, size: int, digest: str, progress: BackupJob) -> str:
+    '''Returns "missing" or "corrupt" if the file doesn't match, or None if it does.'''
+    try:
+        if os.path.getsize(path) != size:
+            return "corrupt"
+        matches = hash_file(path) == digest
+    except FileNotFoundError:
+        return "missing"
+    finally:
+        progress.advance(1, size)
+        progress.throttle(size)
+    return None if matches else "corrupt"
+
+
+def _verify_directory(backup_path: str, files: Dict, chunk_store: str, progress: BackupJob) -> Tuple[List[str], List[str]]:
+    problems = {"missing": [], "corrupt": []}
+
+    def check(item: tuple) -> Tuple[str, str]:
+        key, (size, digest) = item
+        return key, _check_file(os.path.join(backup_path, *key.split("/")), size, digest, progress)
+
+    with ThreadPoolExecutor(_HASH_WORKERS, thread_name_prefix="BackupVerify") as executor:
+        for key, problem in executor.map(check, files.items()):
+            if problem != None:
+                problems[problem].append(key)
+
+        chunks = set()
+        for key in files:
+            if key.endswith(REGION_SUFFIX + CHUNK_MANIFEST_SUFFIX) and key not in problems["missing"]:
+                manifest = _read_manifest(os.path.join(backup_path, *key.split("/")))
+                if manifest != None:
+                    chunks.update(entry[2] for entry in manifest["chunks"] if entry != None)
+
+        def check_chunk(digest: str) -> Tuple[str, str]:
+            try:
+                return digest, None if hash_file(_chunk_path(chunk_store, digest)) == digest else "corrupt"
+            except FileNotFoundError:
+                return digest, "missing"
+
+        for digest, problem in executor.map(check_chunk, chunks):
+            if problem != None:
+                problems[problem].append(f"chunk:{digest}")
+    return problems["missing"], problems["corrupt"]
+
+
+def _verify_archive(backup_path: str, files: Dict, progress: BackupJob) -> Tuple[List[str], List[str]]:
+    '''Archives can only be decompressed in order, so members are hashed as they are read.'''
+    corrupt = []
+    seen = set()
+    try:
+        _hash_archive_members(backup_path, files, progress, seen, corrupt)
+    except (tarfile.TarError, EOFError, OSError, zlib.error, lzma.LZMAError) as e:
+        corrupt.append(f"archive:{e}")
+    return [key for key in files if key not in seen], corrupt
+
+
+def _hash_archive_members(backup_path: str, files: Dict, progress: BackupJob, seen: set, corrupt: List[str]):
+    with tarfile.open(backup_path, "r:*") as tar:
+        for member in tar:
+            if not member.isfile() or member.name not in files:
+                continue
+            size, expected = files[member.name]
+            seen.add(member.name)
+            digest = hashlib.sha256()
+            data = tar.extractfile(member)
+            while True:
+                block = data.read(_MMAP_THRESHOLD)
+                if not block:
+                    break
+                digest.update(block)
+            if member.size != size or digest.hexdigest() != expected:
+                corrupt.append(member.name)
+            progress.advance(1, size)
+            progress.throttle(size)
@@ -0,0 +1,65 @@
+from server.supervisor import ServerSupervisor, get_supervisor
+from config.configs import ObsidiaConfigParser
+from typing import Callable, Dict, List, Tuple
+import threading
+
+
+class ConfigWatcher:
+    '''
+    Checks config files for changes while Obsidia runs, calling back when one has changed.
+
+    Every watched file is checked by the same job on the supervisor's scheduler, one stat each, rather than each server
+    waking up on its own to check its file.
+
+    Parameters
+    ----------
+    supervisor: `ServerSupervisor`
+        The supervisor whose scheduler runs the checks (and so the callbacks), default is the one shared by the whole process
+    '''
+
+    # how often the files are checked for changes, in seconds
+    POLL_INTERVAL = 5
+
+    def __init__(self, supervisor: ServerSupervisor = None):
+        self._supervisor = supervisor if supervisor != None else get_supervisor()
+        self._lock = threading.Lock()
+        self._watched: List[Tuple[ObsidiaConfigParser, Callable[[], None]]] = []
+        self._started = False
+
+    def watch(self, config: ObsidiaConfigParser, callback: Callable[[], None]):
+        '''
+        Calls callback (on the supervisor's loop) whenever the config's file changes, after it has been read again.
+
+        Exceptions raised by the callback are printed, and it is still called for later changes.
+        '''
+        with self._lock:
+            self._watched.append((config, callback))
+            if not self._started:
+                self._started = True
+                self._supervisor.scheduler.call_later(self.POLL_INTERVAL, self._check)
+
+    def _check(self):
+        self._supervisor.scheduler.call_later(self.POLL_INTERVAL, self._check)
+        with self._lock:
+            watched = list(self._watched)
+        for config, callback in watched:
+            try:
+                if config.reload_if_changed():
+                    callback()
+            except Exception as e:
+                print(f"[WARNING] Applying changes to {config.get_config_file()} failed: {e}")
+
+
+_watchers: Dict[ServerSupervisor, ConfigWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def get_config_watcher(supervisor: ServerSupervisor = None) -> ConfigWatcher:
+    '''Returns the watcher shared by every server on the supervisor (default is the one shared by the whole process).'''
+    if supervisor == None:
+        supervisor = get_supervisor()
+    with _watchers_lock:
+        watcher = _watchers.get(supervisor)
+        if watcher == None:
+            watcher = _watchers[supervisor] = ConfigWatcher(supervisor)
+        return watcher
@@ -0,0 +1,127 @@
+from collections import deque
+from typing import Callable, Deque, List, Tuple
+import itertools
+import threading
+
+
+class ConsoleBuffer:
+    '''
+    Keeps the most recent console lines of a server in memory, so they can be read without touching the log on disk.
+
+    Lines are encoded into a fixed size byte arena that is reused as a ring, the oldest lines are dropped to make room.
+    Every line gets a sequence number one higher than the last (starting at 1), so readers can ask for lines after one they've seen.
+    All of the methods are safe to call from any thread.
+
+    Parameters
+    ----------
+    capacity: `int`
+        The size of the arena in bytes, no line longer than this is kept whole
+    max_lines: `int`
+        The most lines kept, regardless of how short they are
+
+    Attributes
+    ----------
+    condition: `threading.Condition`
+        Notified whenever lines are added, hold it to wait for new output
+    '''
+
+    def __init__(self, capacity: int = 1024 * 1024, max_lines: int = 10000):
+        self._arena = bytearray(capacity)
+        self._max_lines = max_lines
+        # (start, length) in the arena of each line still kept, oldest first, lengths include the trailing newline
+        self._entries: Deque[Tuple[int, int]] = deque()
+        self._position = 0
+        self._next_seq = 1
+        self.condition = threading.Condition()
+
+    @property
+    def first_seq(self) -> int:
+        '''The sequence number of the oldest line kept (equal to next_seq if there are none).'''
+        with self.condition:
+            return self._next_seq - len(self._entries)
+
+    @property
+    def next_seq(self) -> int:
+        '''The sequence number the next line added will get.'''
+        with self.condition:
+            return self._next_seq
+
+    def append(self, line: str) -> int:
+        '''Adds a line, dropping the oldest lines if there isn't room. Returns the line's sequence number.'''
+        return self.extend([line])
+
+    def extend(self, lines: List[str]) -> int:
+        '''Adds several lines at once, which is much cheaper than adding them one by one. Returns the last line's sequence number.'''
+        return self.extend_raw([line.encode(errors="replace") for line in lines])
+
+    def extend_raw(self, lines: List[bytes]) -> int:
+        '''Adds several UTF-8 encoded lines at once (without line breaks), saving a decode and encode when they came from a pipe.'''
+        arena = self._arena
+        capacity = len(arena)
+        max_lines = self._max_lines
+        entries = self._entries
+        with self.condition:
+            position = self._position
+            for line in lines:
+                data = line[:capacity - 1] + b"\n"
+                end = position + len(data)
+                if end > capacity:
+                    # not enough room before the end, everything between here and the end is the oldest output
+                    while entries and entries[0][0] >= position:
+                        entries.popleft()
+                    position = 0
+                    end = len(data)
+                # drop the oldest lines until the new one fits
+                while entries and (len(entries) >= max_lines or position <= entries[0][0] < end):
+                    entries.popleft()
+                arena[position:end] = data
+                entries.append((position, end - position))
+                position = end
+            self._position = position
+            self._next_seq += len(lines)
+            self.condition.notify_all()
+            return self._next_seq - 1
+
+    def read_after(self, seq: int = 0, limit: int = None) -> Tuple[List[str], int]:
+        '''
+        Returns the lines with sequence numbers after seq, oldest first (up to limit of them).
+
+        If lines after seq have already been dropped, reading starts from the oldest line kept.
+        A seq that hasn't been reached yet (e.g. from before Obsidia restarted) reads from the start too.
+
+        Return
+        ------
+        The lines, and the sequence number of the last line returned (seq if there were none) to pass next time
+        '''
+        with self.condition:
+            if seq >= self._next_seq:
+                seq = 0
+            first = self._next_seq - len(self._entries)
+            start = max(seq + 1, first)
+            end = self._next_seq if limit == None else min(self._next_seq, start + limit)
+            lines = [self._arena[offset:offset + size - 1].decode(errors="replace")
+                     for offset, size in itertools.islice(self._entries, start - first, end - first)]
+            return lines, max(seq, end - 1)
+
+    def wait_after(self, seq: int, timeout: float = None, limit: int = None,
+                   until: Callable[[], bool] = None) -> Tuple[List[str], int]:
+        '''
+        Like read_after, but waits up to timeout seconds (forever if None) for a line after seq if there isn't one yet.
+
+        Any number of readers can wait at once, they all share the one condition rather than each having a queue.
+        until is also checked whenever the condition is notified, to stop waiting early (e.g. when the reader is being closed).
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self._next_seq - 1 != seq or (until != None and until()), timeout)
+            return self.read_after(seq, limit)
+
+    def tail(self, lines: int) -> Tuple[List[str], int]:
+        '''Returns up to the last few lines, and the sequence number of the last one to pass to read_after later.'''
+        with self.condition:
+            return self.read_after(self._next_seq - 1 - lines)
+
+    def clear(self):
+        '''Drops every line, sequence numbers keep counting up.'''
+        with self.condition:
+            self._entries.clear()
+            self._position = 0
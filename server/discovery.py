@@ -0,0 +1,88 @@
+from server.server_manager import ServerManager
+from server.supervisor import ServerSupervisor, get_supervisor
+from server.registry import ServerRegistry
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Iterable, List
+import asyncio
+import os
+
+
+# how long a server may take to finish booting before the next one waiting is allowed to start anyway, in seconds
+BOOT_TIMEOUT = 600
+
+
+def _is_server_directory(path: str) -> bool:
+    '''Returns true if the directory contains a jar file.'''
+    try:
+        with os.scandir(path) as entries:
+            return any(entry.name.endswith(".jar") and entry.is_file() for entry in entries)
+    except OSError:
+        return False
+
+
+def _load_server(path: str) -> ServerManager:
+    '''Returns a manager for the server in path, or None if it isn't a server.'''
+    if not _is_server_directory(path):
+        return None
+    return ServerManager(path)
+
+
+def discover_servers(servers_directory: str, registry: ServerRegistry, workers: int = 8) -> List[ServerManager]:
+    '''
+    Finds every server (a folder containing a jar) in servers_directory, loading them in parallel.
+
+    Each server is added to the registry as soon as it is loaded, servers that fail to load are reported and skipped.
+    Raises FileNotFoundError if servers_directory can't be read.
+
+    Return
+    ------
+    The servers that were added
+    '''
+    with os.scandir(servers_directory) as entries:
+        folders = [entry.path for entry in entries if entry.is_dir()]
+    added = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="Discovery") as pool:
+        futures = {pool.submit(_load_server, folder): folder for folder in folders}
+        for future in as_completed(futures):
+            try:
+                manager = future.result()
+                if manager != None:
+                    registry.add(manager)
+                    added.append(manager)
+            except Exception as e:
+                print(f"[WARNING] {e} Failed for server: {futures[future]}")
+    return added
+
+
+def boot_servers(managers: Iterable[ServerManager], max_booting: int = 0, supervisor: ServerSupervisor = None) -> Future:
+    '''
+    Starts the given servers, with no more than max_booting (0 for no limit) booting at once, so the host isn't swamped by JVMs.
+
+    A server counts as booting until it is ready, stops, or BOOT_TIMEOUT passes.
+
+    Return
+    ------
+    A future that completes once every server has been started and finished booting
+    '''
+    if supervisor == None:
+        supervisor = get_supervisor()
+    return supervisor.submit(_boot_all(list(managers), max_booting))
+
+
+async def _boot_all(managers: List[ServerManager], max_booting: int):
+    semaphore = asyncio.Semaphore(max_booting) if max_booting > 0 else None
+    await asyncio.gather(*(_boot(manager, semaphore) for manager in managers))
+
+
+async def _boot(manager: ServerManager, semaphore: asyncio.Semaphore):
+    if semaphore == None:
+        manager.start_server()
+        return
+    async with semaphore:
+        if manager.server_should_be_running():  # started from the web console while waiting
+            return
+        manager.start_server()
+        waited = 0
+        while manager.server_should_be_running() and not manager.server_active() and waited < BOOT_TIMEOUT:
+            await asyncio.sleep(0.5)
+            waited += 0.5
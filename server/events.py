@@ -0,0 +1,302 @@
+from array import array
+from typing import Callable, Dict, List, Set, Tuple
+import threading
+import math
+import time
+import re
+
+
+class EventRule:
+    '''
+    Turns console lines into one kind of event.
+
+    Only lines containing keyword are searched for pattern, which keeps the parser cheap since most lines contain none of the
+    keywords. Both work on raw bytes, so lines that don't match are never decoded.
+
+    Parameters
+    ----------
+    kind: `str`
+        The kind of event made, such as "join"
+    keyword: `bytes`
+        A plain string every matching line contains
+    pattern: `bytes`
+        A regex making an event for each line it is found in, searched for with re.MULTILINE (so ^ and $ match at the start
+        and end of the line)
+    convert: `Callable[[re.Match], object]`
+        Makes the event's value from the match, default is the first group decoded (or None if there are no groups)
+    '''
+
+    def __init__(self, kind: str, keyword: bytes, pattern: bytes, convert: Callable[[re.Match], object] = None):
+        self.kind = kind
+        self.keyword = keyword
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.convert = convert if convert != None else _first_group
+
+
+def _first_group(match: re.Match) -> object:
+    if match.re.groups == 0:
+        return None
+    return match.group(1).decode(errors="replace")
+
+
+def _logged(message: bytes, level: bytes = rb"[A-Z]+") -> bytes:
+    '''
+    Anchors a pattern to just after the prefix every logged line starts with, so chat, which only ever comes after it as
+    "<player> message", can't match. That is "[time] [thread/LEVEL]: " on vanilla (modded servers may add a " [logger]"
+    before the colon), or "[time LEVEL]: " on Paper, Spigot and Bukkit.
+    '''
+    return rb"^(?:\[[^\]\n]*\] )?\[[^\]\n]*(?:/| )" + level + rb"\](?: \[[^\]\n]*\])?: " + message
+
+
+# the events every server gets, values are a player name, (milliseconds, ticks) behind, an exception class, or seconds to start
+DEFAULT_RULES = [
+    EventRule("join", b" joined the game", _logged(rb"(\w+) joined the game$", rb"INFO")),
+    EventRule("leave", b" left the game", _logged(rb"(\w+) left the game$", rb"INFO")),
+    EventRule("lag", b"Can't keep up!", _logged(rb"Can't keep up! .*?Running (\d+)ms or (\d+) ticks behind", rb"WARN"),
+              lambda match: (int(match.group(1)), int(match.group(2)))),
+    # the first line of a stack trace, or an exception logged on its own, but not the "Caused by:" lines that follow
+    EventRule("exception", b"Exception", rb"^(?!Caused by)(?:(?:\[[^\]\n]*\] )?\[[^\]\n]*\]: )?((?:[\w$]+\.)+[\w$]*Exception)\b"),
+    EventRule("save", b"Saved the game", _logged(rb"Saved the game$", rb"INFO")),
+    EventRule("save", b"All dimensions are saved", _logged(rb"(?:\w+: )?All dimensions are saved$", rb"INFO")),
+    EventRule("ready", b"]: Done (", _logged(rb"Done \((?:([\d.]+)s\))?", rb"INFO"),
+              lambda match: float(match.group(1)) if match.group(1) != None else None),
+    EventRule("eula", b"]: You need to agree to the EULA", _logged(rb"You need to agree to the EULA", rb"INFO")),
+]
+
+
+class EventParser:
+    '''
+    Pulls structured events (players joining, lag warnings, exceptions, etc.) out of console lines.
+
+    Parameters
+    ----------
+    rules: `list[EventRule]`
+        The rules to apply, default is DEFAULT_RULES, more can be added with add_rule
+    '''
+
+    def __init__(self, rules: List[EventRule] = None):
+        self._rules: List[EventRule] = list(rules if rules != None else DEFAULT_RULES)
+
+    def add_rule(self, rule: EventRule):
+        '''Adds a rule, applied after the existing ones.'''
+        self._rules.append(rule)
+
+    def parse(self, raw_lines: List[bytes]) -> List[Tuple[str, object]]:
+        '''
+        Returns the events in a batch of lines, as (kind, value) in the order of the lines.
+
+        A line can make more than one event, if more than one rule matches it.
+        '''
+        # the batch is searched as one string for each keyword, and the pattern is only tried on the lines the keyword is in
+        # (the patterns are anchored to the start of the line, which regex can't skip ahead to the way it can a plain string)
+        text = b"\n".join(raw_lines)
+        found: List[Tuple[int, int, str, object]] = []
+        for rule_number, rule in enumerate(self._rules):
+            position = text.find(rule.keyword)
+            while position != -1:
+                start = text.rfind(b"\n", 0, position) + 1
+                end = text.find(b"\n", position)
+                if end == -1:
+                    end = len(text)
+                match = rule.pattern.search(text, start, end)
+                if match != None:
+                    found.append((start, rule_number, rule.kind, rule.convert(match)))
+                position = text.find(rule.keyword, end)
+        if len(found) > 1:
+            found.sort(key=lambda event: (event[0], event[1]))
+        return [(kind, value) for _, _, kind, value in found]
+
+
+class TimeSeries:
+    '''
+    A fixed number of evenly spaced buckets of a value over time, the oldest are overwritten as time goes on.
+
+    Parameters
+    ----------
+    resolution: `float`
+        How many seconds each bucket covers
+    length: `int`
+        How many buckets are kept
+    mode: `str`
+        How values in the same bucket are combined, one of:
+            "sum" - added up, for counting events (a bucket with nothing in it is 0)
+            "max" - the largest is kept (a bucket with nothing in it has no value)
+            "last" - the latest is kept, and a bucket with nothing in it has the value of the one before, for levels like players online
+    '''
+
+    MODES = ["sum", "max", "last"]
+
+    def __init__(self, resolution: float = 60, length: int = 1440, mode: str = "sum"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown mode {mode}, expected one of {', '.join(self.MODES)}")
+        self.resolution = resolution
+        self.length = length
+        self.mode = mode
+        self._values = array("d", [math.nan]) * length
+        # which bucket (time // resolution) each slot holds, so stale slots are recognised without clearing them
+        self._buckets = array("q", [-1]) * length
+        self._last_value = math.nan
+
+    def add(self, value: float, now: float = None):
+        '''Puts value into the bucket for now (default is the current time).'''
+        bucket = int((now if now != None else time.time()) // self.resolution)
+        slot = bucket % self.length
+        if self._buckets[slot] != bucket:
+            self._buckets[slot] = bucket
+            self._values[slot] = value
+        elif self.mode == "sum":
+            self._values[slot] += value
+        elif self.mode == "max":
+            if value > self._values[slot]:
+                self._values[slot] = value
+        else:
+            self._values[slot] = value
+        self._last_value = value
+
+    def points(self, since: float = None, now: float = None) -> List[Tuple[float, float]]:
+        '''
+        Returns (bucket start time, value) for every bucket from since (default is as far back as is kept) up to now, oldest first.
+
+        The value is None for buckets with no value.
+        '''
+        last = int((now if now != None else time.time()) // self.resolution)
+        first = last - self.length + 1
+        if since != None:
+            first = max(first, int(since // self.resolution))
+        points = []
+        carried = math.nan
+        if self.mode == "last":
+            # the level at the start of the range is whatever was last set before it
+            for bucket in range(last - self.length + 1, first):
+                if self._buckets[bucket % self.length] == bucket:
+                    carried = self._values[bucket % self.length]
+        for bucket in range(first, last + 1):
+            slot = bucket % self.length
+            value = self._values[slot] if self._buckets[slot] == bucket else math.nan
+            if self.mode == "sum" and math.isnan(value):
+                value = 0.0
+            elif self.mode == "last":
+                if math.isnan(value):
+                    value = carried
+                carried = value
+            points.append((bucket * self.resolution, None if math.isnan(value) else value))
+        return points
+
+    def latest(self) -> float:
+        '''Returns the last value added, or None if there hasn't been one.'''
+        return None if math.isnan(self._last_value) else self._last_value
+
+
+class ServerEvents:
+    '''
+    Keeps track of the events in a server's console, as time series and who is online.
+
+    The series are "players" (online), "joins", "lag_ms" (the worst "Can't keep up!" in each bucket), "lag_warnings",
+    "exceptions", and "saves". Buckets are by the time lines arrive, not the times in the log.
+
+    Parameters
+    ----------
+    parser: `EventParser`
+        What finds the events, default is one with the DEFAULT_RULES
+    resolution: `float`
+        How many seconds each bucket of the series covers, default a minute
+    length: `int`
+        How many buckets of each series are kept, default a day's worth
+    on_players_change: `Callable[[], None]`
+        Called (from the thread reading the console) whenever someone joins or leaves, or everyone is cleared
+
+    Attributes
+    ----------
+    parser: `EventParser`
+        What finds the events, rules can be added to it
+    '''
+
+    # the series counting each kind of event
+    _COUNTED = {"join": "joins", "lag": "lag_warnings", "exception": "exceptions", "save": "saves"}
+
+    def __init__(self, parser: EventParser = None, resolution: float = 60, length: int = 1440,
+                 on_players_change: Callable[[], None] = None):
+        self.parser = parser if parser != None else EventParser()
+        self._lock = threading.Lock()
+        self._series: Dict[str, TimeSeries] = {
+            "players": TimeSeries(resolution, length, "last"),
+            "joins": TimeSeries(resolution, length, "sum"),
+            "lag_ms": TimeSeries(resolution, length, "max"),
+            "lag_warnings": TimeSeries(resolution, length, "sum"),
+            "exceptions": TimeSeries(resolution, length, "sum"),
+            "saves": TimeSeries(resolution, length, "sum"),
+        }
+        self._players: Set[str] = set()
+        self._counts: Dict[str, int] = {}
+        self._last_exception: str = None
+        self._on_players_change = on_players_change
+
+    def feed(self, raw_lines: List[bytes]) -> List[Tuple[str, object]]:
+        '''Parses a batch of console lines and records their events, returning the events (see EventParser.parse).'''
+        events = self.parser.parse(raw_lines)
+        if len(events) == 0:
+            return events
+        # the whole batch arrived at once so it all goes in the same bucket, added up first to update each series once
+        batch_counts: Dict[str, int] = {}
+        worst_lag = None
+        players_changed = False
+        with self._lock:
+            for kind, value in events:
+                batch_counts[kind] = batch_counts.get(kind, 0) + 1
+                if kind == "join":
+                    self._players.add(value)
+                    players_changed = True
+                elif kind == "leave":
+                    self._players.discard(value)
+                    players_changed = True
+                elif kind == "lag":
+                    if worst_lag == None or value[0] > worst_lag:
+                        worst_lag = value[0]
+                elif kind == "exception":
+                    self._last_exception = value
+            now = time.time()
+            for kind, count in batch_counts.items():
+                self._counts[kind] = self._counts.get(kind, 0) + count
+                series = self._COUNTED.get(kind)
+                if series != None:
+                    self._series[series].add(count, now)
+            if worst_lag != None:
+                self._series["lag_ms"].add(worst_lag, now)
+            if players_changed:
+                self._series["players"].add(len(self._players), now)
+        if players_changed and self._on_players_change != None:
+            self._on_players_change()
+        return events
+
+    def clear_players(self):
+        '''Marks everyone as offline, for when the server stops (players aren't shown leaving if it crashes).'''
+        with self._lock:
+            had_players = len(self._players) > 0 or self._series["players"].latest() != 0
+            self._players.clear()
+            self._series["players"].add(0)
+        if had_players and self._on_players_change != None:
+            self._on_players_change()
+
+    def players(self) -> List[str]:
+        '''Returns who is online, in alphabetical order.'''
+        with self._lock:
+            return sorted(self._players)
+
+    def summary(self) -> Dict:
+        '''
+        Returns the current state: the "players" online, the latest "lag_ms" (None if the server has never fallen behind),
+        the "last_exception" class seen, and the total "counts" of each kind of event.
+        '''
+        with self._lock:
+            return {
+                "players": sorted(self._players),
+                "lag_ms": self._series["lag_ms"].latest(),
+                "last_exception": self._last_exception,
+                "counts": dict(self._counts),
+            }
+
+    def series(self, since: float = None) -> Dict[str, List[Tuple[float, float]]]:
+        '''Returns every series, as lists of (bucket start time, value) from since (default all that is kept), see TimeSeries.points.'''
+        now = time.time()
+        with self._lock:
+            return {name: series.points(since, now) for name, series in self._series.items()}
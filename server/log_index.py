@@ -0,0 +1,269 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Set, Tuple
+import threading
+import queue
+import sqlite3
+import gzip
+import re
+import os
+
+
+# rotated logs are named like 2023-05-01-1.log.gz, after the day they start on
+ROTATED_LOG = re.compile(r"^(\d{4})-(\d{2})-(\d{2})-\d+\.log\.gz$")
+# lines start with the time of day, like "[12:34:56] [Server thread/INFO]: ..." (or "[01May2023 12:34:56.789]" on some servers)
+LINE_TIME = re.compile(rb"^\[(?:[^\]\s]*\s)?(\d{2}):(\d{2}):(\d{2})")
+# threads can log slightly out of order, so only a big jump back in the time of day counts as passing midnight
+MIDNIGHT_JUMP = 12 * 3600
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, identity TEXT, offset INTEGER, day INTEGER, clock INTEGER)",
+    "CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, file TEXT, offset INTEGER, time REAL)",
+    "CREATE INDEX IF NOT EXISTS entries_time ON entries (time)",
+    "CREATE INDEX IF NOT EXISTS entries_file ON entries (file)",
+    # player names can contain underscores, which would otherwise split them into several tokens
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entries_text USING fts5(text, tokenize=\"unicode61 tokenchars '_'\")",
+]
+
+
+class LogIndex:
+    '''
+    A full text index of a server's logs (latest.log and the rotated .log.gz files), kept in an SQLite database.
+
+    update indexes whatever has been written since the last update, each rotated log is only ever read once.
+    Lines are timestamped from the time at the start of each line and the date the log started, so times are local.
+
+    Parameters
+    ----------
+    log_directory: `str`
+        The server's logs directory, which doesn't need to exist yet
+    index_file: `str`
+        The database file, default "obsidia_index.db" in the logs directory
+    '''
+
+    # how many lines are inserted per transaction
+    _BATCH_LINES = 5000
+    _LATEST_LOG = "latest.log"
+
+    def __init__(self, log_directory: str, index_file: str = None):
+        self.log_directory = log_directory
+        self.index_file = index_file if index_file != None else os.path.join(log_directory, "obsidia_index.db")
+        self._update_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.index_file, timeout=30)
+        # readers aren't blocked by an update in progress
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    def is_updating(self) -> bool:
+        '''Returns true if an update is in progress.'''
+        return self._update_lock.locked()
+
+    def update(self) -> int:
+        '''
+        Indexes new rotated logs and whatever has been added to latest.log, returning the number of lines added.
+
+        Does nothing if the logs directory doesn't exist, or if another update is already in progress.
+        '''
+        if not os.path.isdir(self.log_directory) or not self._update_lock.acquire(blocking=False):
+            return 0
+        try:
+            connection = self._connect()
+            try:
+                added = 0
+                indexed = {name: (identity, offset, day, clock) for name, identity, offset, day, clock
+                           in connection.execute("SELECT name, identity, offset, day, clock FROM files")}
+                for name in sorted(os.listdir(self.log_directory)):
+                    match = ROTATED_LOG.match(name)
+                    if match != None and name not in indexed:
+                        start = date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+                        with gzip.open(os.path.join(self.log_directory, name), "rb") as file:
+                            added += self._index(connection, name, "", file, 0, start.toordinal(), 0)
+                added += self._update_latest(connection, indexed.get(self._LATEST_LOG))
+                return added
+            finally:
+                connection.close()
+        finally:
+            self._update_lock.release()
+
+    def _update_latest(self, connection: sqlite3.Connection, indexed: Tuple) -> int:
+        path = os.path.join(self.log_directory, self._LATEST_LOG)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        identity = f"{stat.st_dev}:{stat.st_ino}"
+        if indexed != None and (indexed[0] != identity or indexed[1] > stat.st_size):
+            # rotated since the last update, the old contents will be indexed again from the .log.gz
+            with connection:
+                connection.execute("DELETE FROM entries_text WHERE rowid IN (SELECT id FROM entries WHERE file = ?)", (self._LATEST_LOG,))
+                connection.execute("DELETE FROM entries WHERE file = ?", (self._LATEST_LOG,))
+                connection.execute("DELETE FROM files WHERE name = ?", (self._LATEST_LOG,))
+            indexed = None
+        with open(path, "rb") as file:
+            if indexed == None:
+                # the log ends around its modification time, so count back the days it spans to find when it started
+                rollovers = _count_rollovers(file)
+                file.seek(0)
+                start = datetime.fromtimestamp(stat.st_mtime).date() - timedelta(days=rollovers)
+                return self._index(connection, self._LATEST_LOG, identity, file, 0, start.toordinal(), 0)
+            file.seek(indexed[1])
+            return self._index(connection, self._LATEST_LOG, identity, file, indexed[1], indexed[2], indexed[3])
+
+    def _index(self, connection: sqlite3.Connection, name: str, identity: str, file, offset: int, day: int, clock: int) -> int:
+        '''Indexes complete lines from file (positioned at offset), recording how far it got. Returns the number of lines added.'''
+        added = 0
+        batch: List[Tuple[int, float, str]] = []
+        for line in file:
+            if not line.endswith(b"\n"):  # still being written, pick it up next time
+                break
+            match = LINE_TIME.match(line)
+            if match != None:
+                line_clock = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+                if line_clock < clock - MIDNIGHT_JUMP:  # went past midnight
+                    day += 1
+                clock = line_clock
+            text = line.decode(errors="replace").rstrip()
+            if text != "":
+                line_time = datetime.combine(date.fromordinal(day), datetime.min.time()).timestamp() + clock
+                batch.append((offset, line_time, text))
+            offset += len(line)
+            if len(batch) >= self._BATCH_LINES:
+                self._insert(connection, name, identity, batch, offset, day, clock)
+                added += len(batch)
+                batch = []
+        self._insert(connection, name, identity, batch, offset, day, clock)
+        return added + len(batch)
+
+    def _insert(self, connection: sqlite3.Connection, name: str, identity: str, batch: List[Tuple[int, float, str]],
+                offset: int, day: int, clock: int):
+        with connection:
+            # only one update runs at a time, so the IDs can be handed out up front and the rows inserted in bulk
+            first_id = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM entries").fetchone()[0]
+            connection.executemany("INSERT INTO entries (id, file, offset, time) VALUES (?, ?, ?, ?)",
+                                   ((first_id + i, name, line_offset, line_time) for i, (line_offset, line_time, _) in enumerate(batch)))
+            connection.executemany("INSERT INTO entries_text (rowid, text) VALUES (?, ?)",
+                                   ((first_id + i, text) for i, (_, _, text) in enumerate(batch)))
+            connection.execute("INSERT OR REPLACE INTO files (name, identity, offset, day, clock) VALUES (?, ?, ?, ?, ?)",
+                               (name, identity, offset, day, clock))
+
+    def search(self, query: str = "", start: float = None, end: float = None, limit: int = 100) -> List[Dict]:
+        '''
+        Finds log lines containing every word of query (or any line if it is blank), newest first.
+
+        Parameters
+        ----------
+        query: `str`
+            The words to look for, case insensitive (e.g. a player name, or "exception")
+        start: `float`
+            Only lines from this epoch time on, or None for no limit
+        end: `float`
+            Only lines from before this epoch time, or None for no limit
+        limit: `int`
+            The most lines to return
+
+        Return
+        ------
+        A list of dicts with the line's "time" (epoch), the "file" it is in, its "offset" in the file, and its "text"
+        '''
+        conditions = []
+        parameters = []
+        words = query.split()
+        if len(words) > 0:
+            # every word is quoted, so nothing the user types is taken as query syntax
+            conditions.append("entries_text MATCH ?")
+            parameters.append(" ".join('"' + word.replace('"', '""') + '"' for word in words))
+        if start != None:
+            conditions.append("entries.time >= ?")
+            parameters.append(start)
+        if end != None:
+            conditions.append("entries.time < ?")
+            parameters.append(end)
+        where = "WHERE " + " AND ".join(conditions) if len(conditions) > 0 else ""
+        # with words the text index finds the lines, otherwise walk the time index and look up their text
+        tables = "entries_text JOIN entries ON entries.id = entries_text.rowid" if len(words) > 0 else \
+            "entries CROSS JOIN entries_text ON entries_text.rowid = entries.id"
+        if not os.path.exists(self.index_file):
+            return []
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"SELECT entries.time, entries.file, entries.offset, entries_text.text FROM {tables} {where} "
+                                      "ORDER BY entries.time DESC, entries.id DESC LIMIT ?", parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+        return [{"time": time, "file": file, "offset": offset, "text": text} for time, file, offset, text in rows]
+
+
+class IndexUpdater:
+    '''
+    Updates log indexes on a fixed number of background threads, so every server's updates share them rather than each
+    update getting a thread of its own. Indexes already waiting for an update aren't queued again.
+
+    The threads are daemons, so an update in progress never holds up Obsidia exiting (it carries on from where it got to next time).
+
+    Parameters
+    ----------
+    workers: `int`
+        How many indexes may be updated at once
+    '''
+
+    def __init__(self, workers: int = 2):
+        self._workers = workers
+        self._queue: "queue.Queue[LogIndex]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending: Set[LogIndex] = set()
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, index: LogIndex) -> bool:
+        '''Queues an update of the index, returning false if one is already waiting or in progress.'''
+        with self._lock:
+            if index in self._pending:
+                return False
+            self._pending.add(index)
+            if len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._work, name=f"LogIndex-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        self._queue.put(index)
+        return True
+
+    def _work(self):
+        while True:
+            index = self._queue.get()
+            try:
+                index.update()
+            except Exception as e:
+                print(f"[WARNING] {e} Failed to index the logs in: {index.log_directory}")
+            finally:
+                with self._lock:
+                    self._pending.discard(index)
+
+
+_updater: IndexUpdater = None
+_updater_lock = threading.Lock()
+
+
+def get_index_updater() -> IndexUpdater:
+    '''Returns the updater shared by every server in this process.'''
+    global _updater
+    with _updater_lock:
+        if _updater == None:
+            _updater = IndexUpdater()
+        return _updater
+
+
+def _count_rollovers(lines: Iterator[bytes]) -> int:
+    '''Counts how many times the time of day goes backwards (past midnight) in a log.'''
+    rollovers = 0
+    clock = 0
+    for line in lines:
+        match = LINE_TIME.match(line)
+        if match != None:
+            line_clock = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+            if line_clock < clock - MIDNIGHT_JUMP:
+                rollovers += 1
+            clock = line_clock
+    return rollovers
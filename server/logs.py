@@ -0,0 +1,112 @@
+from typing import List, Tuple
+import threading
+import os
+
+
+class LogReader:
+    '''
+    Reads the end of a log file that is being appended to, without reading the whole file.
+
+    The file handle is kept open between reads and reopened when the file is rotated (replaced or truncated).
+
+    Parameters
+    ----------
+    log_file: `str`
+        The log file to read, which doesn't need to exist yet
+    '''
+
+    # how far to step backwards from the end of the file when looking for line breaks
+    _BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, log_file: str):
+        self.log_file = log_file
+        self._file = None
+        self._identity: Tuple[int, int] = None
+        self._file_size = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> bool:
+        '''Opens the log, or reopens it if it was rotated. Returns false if there is no log.'''
+        try:
+            stat = os.stat(self.log_file)
+        except OSError:
+            self._close()
+            return False
+        identity = (stat.st_dev, stat.st_ino)
+        if self._file != None and identity == self._identity and stat.st_size >= self._file_size:
+            self._file_size = stat.st_size
+            return True
+        self._close()
+        try:
+            self._file = open(self.log_file, "rb")
+        except OSError:
+            return False
+        self._identity = identity
+        self._file_size = stat.st_size
+        return True
+
+    def _close(self):
+        if self._file != None:
+            self._file.close()
+        self._file = None
+        self._identity = None
+
+    def close(self):
+        '''Closes the cached file handle.'''
+        with self._lock:
+            self._close()
+
+    def size(self) -> int:
+        '''Returns the current size of the log, 0 if there is none.'''
+        with self._lock:
+            return self._file_size if self._open() else 0
+
+    def tail(self, lines: int) -> Tuple[List[str], int]:
+        '''
+        Returns up to the last few lines of the log, found by reading backwards from the end.
+
+        Return
+        ------
+        The lines (without line breaks) and the offset of the end of the file, to pass to read_from later
+        '''
+        with self._lock:
+            if not self._open():
+                return [], 0
+            end = self._file_size
+            position = end
+            data = b""
+            # one more line break than lines wanted, so that the first line is known to be complete
+            while position > 0 and data.count(b"\n") <= lines:
+                step = min(self._BLOCK_SIZE, position)
+                position -= step
+                self._file.seek(position)
+                data = self._file.read(step) + data
+            found = data.split(b"\n")
+            if found[-1] == b"":
+                found.pop()
+            return [line.decode(errors="replace").rstrip("\r") for line in found[-lines:]] if lines > 0 else [], end
+
+    def read_from(self, offset: int, max_bytes: int = 4 * 1024 * 1024) -> Tuple[List[str], int]:
+        '''
+        Returns complete lines written after offset (up to about max_bytes of them).
+
+        If the log was rotated and is now shorter than offset, reading starts over from the beginning.
+
+        Return
+        ------
+        The lines (without line breaks) and the offset to pass next time
+        '''
+        with self._lock:
+            if not self._open():
+                return [], 0
+            if offset > self._file_size:
+                offset = 0
+            self._file.seek(offset)
+            data = self._file.read(min(max_bytes, self._file_size - offset))
+            # only return complete lines, a partial line will be read in full next time
+            end = data.rfind(b"\n") + 1
+            if end == 0 and len(data) == max_bytes:  # a single enormous line, return what there is rather than stalling
+                end = len(data)
+                data += b"\n"
+            found = data[:end].split(b"\n")[:-1]
+            return [line.decode(errors="replace").rstrip("\r") for line in found], offset + end
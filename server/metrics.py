@@ -0,0 +1,138 @@
+from server.backup_coordinator import BackupCoordinator, get_coordinator
+from server.server_manager import ServerManager
+from typing import Dict, Iterable, List, Tuple
+import os
+
+
+def read_process_stats(pids: Iterable[int]) -> Dict[int, Dict[str, float]]:
+    '''
+    Reads the resident memory ("rss_bytes"), CPU time ("cpu_seconds", user and system) and "threads" of each process,
+    from one read of /proc/<pid>/stat each.
+
+    Processes that have exited are left out, as is everything where there is no /proc (i.e. anything but Linux).
+    '''
+    clock_ticks, page_size = _system_units()
+    stats = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as file:
+                data = file.read()
+        except OSError:
+            continue
+        # the command name is in brackets and may contain spaces, so the fields are counted from after it (the state is field 3)
+        fields = data[data.rindex(b")") + 2:].split()
+        stats[pid] = {
+            "rss_bytes": int(fields[21]) * page_size,
+            "cpu_seconds": (int(fields[11]) + int(fields[12])) / clock_ticks,
+            "threads": int(fields[17]),
+        }
+    return stats
+
+
+_units: Tuple[int, int] = None
+
+
+def _system_units() -> Tuple[int, int]:
+    '''Returns the clock ticks per second and page size /proc reports in.'''
+    global _units
+    if _units == None:
+        try:
+            _units = (os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE"))
+        except (AttributeError, ValueError, OSError):  # not POSIX, there won't be a /proc either
+            _units = (100, 4096)
+    return _units
+
+
+class _MetricWriter:
+    '''Builds the Prometheus text format, with each metric's samples grouped under its HELP and TYPE lines.'''
+
+    def __init__(self):
+        self._metrics: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self, name: str, kind: str, description: str, value: float, labels: Dict[str, str] = None):
+        '''Adds a sample, unless the value is None (unknown).'''
+        if value == None:
+            return
+        if name not in self._metrics:
+            self._metrics[name] = (kind, description, [])
+        label_text = ""
+        if labels != None and len(labels) > 0:
+            label_text = "{" + ",".join(f'{key}="{_escape(label_value)}"' for key, label_value in labels.items()) + "}"
+        self._metrics[name][2].append(f"{name}{label_text} {_format_value(value)}")
+
+    def text(self) -> str:
+        lines = []
+        for name, (kind, description, samples) in self._metrics.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_metrics(managers: Iterable[ServerManager], coordinator: BackupCoordinator = None) -> str:
+    '''
+    Returns the Prometheus text format metrics for every server, Obsidia's own process, and backups.
+
+    The server processes and Obsidia itself are all sampled together, after the rest of the numbers have been gathered.
+    '''
+    if coordinator == None:
+        coordinator = get_coordinator()
+    servers = [(manager.get_name(), manager.get_status()[0], manager.get_metrics()) for manager in managers]
+    own_pid = os.getpid()
+    processes = read_process_stats([metrics["pid"] for _, _, metrics in servers if metrics["pid"] != None] + [own_pid])
+
+    writer = _MetricWriter()
+    for name, status, metrics in servers:
+        labels = {"server": name}
+        writer.add("obsidia_server_up", "gauge", "1 if the server's process is running.", status["running"], labels)
+        writer.add("obsidia_server_ready", "gauge", "1 if the server has finished starting and players can join.", status["ready"], labels)
+        writer.add("obsidia_server_players", "gauge", "Players online.", len(status["players"]), labels)
+        process = processes.get(metrics["pid"])
+        if process != None:
+            writer.add("obsidia_server_resident_memory_bytes", "gauge", "Resident memory of the server's java process.",
+                       process["rss_bytes"], labels)
+            writer.add("obsidia_server_cpu_seconds_total", "counter", "User and system CPU time of the server's java process.",
+                       process["cpu_seconds"], labels)
+            writer.add("obsidia_server_threads", "gauge", "Threads in the server's java process.", process["threads"], labels)
+        writer.add("obsidia_server_console_lines_total", "counter", "Console lines output by the server.", metrics["console_lines"], labels)
+        backlogs = metrics["listener_backlogs"]
+        writer.add("obsidia_server_listeners", "gauge", "Listeners subscribed to the server's console.", len(backlogs), labels)
+        writer.add("obsidia_server_listener_backlog_lines", "gauge", "Console lines the furthest behind listener has yet to take.",
+                   max(backlogs) if len(backlogs) > 0 else 0, labels)
+        writer.add("obsidia_server_boot_seconds", "gauge", "How long the last start took, from launching java to being ready.",
+                   metrics["boot_seconds"], labels)
+        writer.add("obsidia_server_restarts_total", "counter", "Restarts since Obsidia started, by reason.",
+                   metrics["restarts"], dict(labels, reason="restart"))
+        writer.add("obsidia_server_restarts_total", "counter", "Restarts since Obsidia started, by reason.",
+                   metrics["crash_restarts"], dict(labels, reason="crash"))
+        writer.add("obsidia_server_last_backup_duration_seconds", "gauge", "How long the last finished backup took.",
+                   metrics["backup_seconds"], labels)
+        writer.add("obsidia_server_last_backup_bytes", "gauge", "How much the last finished backup copied.", metrics["backup_bytes"], labels)
+
+    own = processes.get(own_pid)
+    if own != None:
+        writer.add("obsidia_manager_resident_memory_bytes", "gauge", "Resident memory of Obsidia itself.", own["rss_bytes"])
+        writer.add("obsidia_manager_cpu_seconds_total", "counter", "User and system CPU time of Obsidia itself.", own["cpu_seconds"])
+        writer.add("obsidia_manager_threads", "gauge", "Threads in Obsidia itself.", own["threads"])
+
+    backups = coordinator.metrics()
+    writer.add("obsidia_backups_running", "gauge", "Backups copying right now.", backups["running"])
+    writer.add("obsidia_backups_queued", "gauge", "Backups waiting for a turn to copy.", backups["queued"])
+    writer.add("obsidia_backups_completed_total", "counter", "Backups finished.", backups["completed"])
+    writer.add("obsidia_backups_queue_seconds_total", "counter", "Time finished backups spent waiting for a turn.",
+               backups["queue_seconds_total"])
+    writer.add("obsidia_backups_copy_seconds_total", "counter", "Time finished backups spent copying.", backups["copy_seconds_total"])
+    writer.add("obsidia_backups_bytes_total", "counter", "Bytes copied by finished backups.", backups["bytes_total"])
+    return writer.text()
@@ -0,0 +1,147 @@
+from server.supervisor import ServerSupervisor, get_supervisor
+from collections import Counter
+from datetime import datetime
+from typing import Dict
+import threading
+import tempfile
+import cProfile
+import time
+import sys
+import os
+
+
+class Profiler:
+    '''
+    Profiles Obsidia for a set number of seconds, one profile at a time, keeping the result in a file to download.
+
+    There are two modes:
+        "sample" - the stack of every thread is sampled every interval, written as folded stacks (one "frame;frame;... count" line
+            per stack, which flamegraph.pl, speedscope and the like read). Cheap enough to leave running on a busy server.
+        "cprofile" - cProfile traces every call on the supervisor's loop thread (where server output is read and restarts and
+            backups are scheduled), written in pstats format (python -m pstats, snakeviz). Slows that thread down while it runs.
+
+    Parameters
+    ----------
+    output_directory: `str`
+        Where profiles are written, default is a new temporary directory (made when the first profile starts)
+    supervisor: `ServerSupervisor`
+        The supervisor whose loop cProfile runs on, default is the one shared by the whole process
+    '''
+
+    MODES = ["sample", "cprofile"]
+
+    def __init__(self, output_directory: str = None, supervisor: ServerSupervisor = None):
+        self._output_directory = output_directory
+        self._supervisor = supervisor if supervisor != None else get_supervisor()
+        self._lock = threading.Lock()
+        self._running = False
+        self._mode: str = None
+        self._started_at: float = None
+        self._ends_at: float = None
+        self._file: str = None
+        self._error: str = None
+
+    def start(self, seconds: float, mode: str = "sample", interval: float = 0.005):
+        '''
+        Starts profiling for the given number of seconds in the background, replacing the last profile once done.
+
+        Raises ValueError for an unknown mode, and RuntimeError if a profile is already running.
+        '''
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profile mode {mode}, expected one of {', '.join(self.MODES)}")
+        with self._lock:
+            if self._running:
+                raise RuntimeError("A profile is already running.")
+            if self._output_directory == None:
+                self._output_directory = tempfile.mkdtemp(prefix="obsidia_profiles_")
+            self._running = True
+            self._mode = mode
+            self._started_at = time.time()
+            self._ends_at = self._started_at + seconds
+            self._error = None
+        extension = "folded" if mode == "sample" else "prof"
+        path = os.path.join(self._output_directory, f"obsidia-{mode}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}")
+        target = self._sample if mode == "sample" else self._trace
+        threading.Thread(target=self._run, args=(target, path, seconds, interval), name="Profiler", daemon=True).start()
+
+    def _run(self, target, path: str, seconds: float, interval: float):
+        error = None
+        try:
+            target(path, seconds, interval)
+        except Exception as e:
+            error = str(e)
+        with self._lock:
+            if error == None:
+                if self._file != None and os.path.exists(self._file):
+                    os.remove(self._file)
+                self._file = path
+            self._error = error
+            self._running = False
+
+    def _sample(self, path: str, seconds: float, interval: float):
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_thread:
+                    continue
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(name.replace(";", ":") for name in reversed(stack))] += 1
+            time.sleep(interval)
+        with open(path, "w") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def _trace(self, path: str, seconds: float, interval: float):
+        profile = cProfile.Profile()
+        # a profile only sees the thread that enabled it, so it has to be turned on and off from the loop itself
+        self._supervisor.submit(_call(profile.enable)).result()
+        try:
+            time.sleep(seconds)
+        finally:
+            self._supervisor.submit(_call(profile.disable)).result()
+        profile.dump_stats(path)
+
+    def status(self) -> Dict:
+        '''
+        Returns whether a profile is "running", its "mode", when it "started_at" and "ends_at" (epoch), the "file" holding the last
+        finished profile (None if there isn't one), and the "error" the last profile failed with (None if it didn't).
+        '''
+        with self._lock:
+            return {
+                "running": self._running,
+                "mode": self._mode,
+                "started_at": self._started_at,
+                "ends_at": self._ends_at,
+                "file": self._file,
+                "error": self._error,
+            }
+
+    def result_file(self) -> str:
+        '''Returns the path of the last finished profile, or None if there isn't one.'''
+        with self._lock:
+            return self._file
+
+
+async def _call(callback):
+    callback()
+
+
+_profiler: Profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    '''Returns the profiler shared by the whole process.'''
+    global _profiler
+    with _profiler_lock:
+        if _profiler == None:
+            _profiler = Profiler()
+        return _profiler
@@ -0,0 +1,63 @@
+from server.server_manager import ServerManager
+from typing import Dict, Iterator, List
+import threading
+import os
+
+
+class ServerRegistry:
+    '''
+    The servers being managed, looked up by name or by directory.
+
+    Names are unique, and are taken from each manager when it is added.
+    Servers can be added and removed at any time, all of the methods are safe to call from any thread.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, ServerManager] = {}
+        self._by_directory: Dict[str, ServerManager] = {}
+
+    def add(self, manager: ServerManager):
+        '''Adds a server, raises ValueError if there is already one with the same name or directory.'''
+        name = manager.get_name()
+        directory = os.path.normcase(manager.server_directory)
+        with self._lock:
+            if name in self._by_name:
+                raise ValueError(f"There is already a server named {name}.")
+            if directory in self._by_directory:
+                raise ValueError(f"The server in {manager.server_directory} has already been added.")
+            self._by_name[name] = manager
+            self._by_directory[directory] = manager
+
+    def remove(self, name: str) -> ServerManager:
+        '''Removes the server with the given name and returns it (without stopping it), or None if there is no such server.'''
+        with self._lock:
+            manager = self._by_name.pop(name, None)
+            if manager != None:
+                del self._by_directory[os.path.normcase(manager.server_directory)]
+            return manager
+
+    def get(self, name: str) -> ServerManager:
+        '''Returns the server with the given name, or None if there is no such server.'''
+        return self._by_name.get(name)
+
+    def get_by_directory(self, server_directory: str) -> ServerManager:
+        '''Returns the server in the given directory, or None if there is no such server.'''
+        return self._by_directory.get(os.path.normcase(os.path.abspath(server_directory)))
+
+    def names(self) -> List[str]:
+        '''Returns the names of every server, in alphabetical order.'''
+        with self._lock:
+            return sorted(self._by_name)
+
+    def __iter__(self) -> Iterator[ServerManager]:
+        '''Iterates over a copy of the servers, in alphabetical order of name.'''
+        with self._lock:
+            managers = [self._by_name[name] for name in sorted(self._by_name)]
+        return iter(managers)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
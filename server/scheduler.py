@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from typing import List
+import itertools
+import asyncio
+import heapq
+import time
+
+
+class Schedule:
+    '''
+    A parsed SMTWRFD HHMM timestamp.
+
+    Parameters
+    ----------
+    timestamp: `str`
+        Days (Sun -> Sat) followed by a 24 hour time, such as "MWF 0330"
+    '''
+
+    _DAYS = "SMTWRFD"
+
+    def __init__(self, timestamp: str):
+        try:
+            days, clock = timestamp.strip().split(" ")
+            self._hour = int(clock[:2])
+            self._minute = int(clock[2:])
+            datetime(2000, 1, 1, self._hour, self._minute)
+        except ValueError:
+            raise ValueError(f"Invalid SMTWRFD HHMM timestamp: {timestamp}")
+        self._days = {i for i, day in enumerate(self._DAYS) if day in days}
+        self.timestamp = timestamp
+
+    def next_fire(self, after: float = None) -> float:
+        '''Returns the epoch time of the next occurrence strictly after the given time (default now), or None if no days are set.'''
+        if after == None:
+            after = time.time()
+        start = datetime.fromtimestamp(after).replace(hour=self._hour, minute=self._minute, second=0, microsecond=0)
+        for i in range(8):
+            candidate = start + timedelta(days=i)
+            if (candidate.weekday() + 1) % 7 in self._days and candidate.timestamp() > after:
+                return candidate.timestamp()
+        return None
+
+    def __str__(self):
+        return self.timestamp
+
+
+class ScheduledJob:
+    '''A callback waiting in a Scheduler, which can be cancelled from any thread.'''
+
+    _counter = itertools.count()
+
+    def __init__(self, when: float, callback, args: tuple):
+        self.when = when
+        self._order = next(self._counter)
+        self._callback = callback
+        self._args = args
+        self.cancelled = False
+
+    def cancel(self):
+        '''Prevents the job from running, if it hasn't already.'''
+        self.cancelled = True
+
+    def __lt__(self, other: "ScheduledJob") -> bool:
+        return (self.when, self._order) < (other.when, other._order)
+
+
+class Scheduler:
+    '''
+    Runs callbacks at wall clock times on the supervisor's loop.
+
+    Every server's jobs share one heap and one task, which sleeps until the earliest job is due.
+    Callbacks may be coroutine functions, in which case they are run as their own task.
+
+    Parameters
+    ----------
+    supervisor: `ServerSupervisor`
+        The supervisor whose loop runs the jobs
+    '''
+
+    # wake up at least this often in case the wall clock jumps (suspend, NTP, etc.)
+    _MAX_SLEEP = 3600
+
+    def __init__(self, supervisor):
+        self._supervisor = supervisor
+        self._heap: List[ScheduledJob] = []
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+
+    def call_at(self, when: float, callback, *args) -> ScheduledJob:
+        '''Schedules callback(*args) to run at the given epoch time. Safe to call from any thread.'''
+        job = ScheduledJob(when, callback, args)
+        self._supervisor.call_soon(self._push, job)
+        return job
+
+    def call_later(self, delay: float, callback, *args) -> ScheduledJob:
+        '''Schedules callback(*args) to run after delay seconds. Safe to call from any thread.'''
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def _push(self, job: ScheduledJob):
+        if self._task == None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        heapq.heappush(self._heap, job)
+        if self._heap[0] == job:
+            self._wakeup.set()
+
+    def close(self):
+        '''Drops every pending job and stops the scheduler task. Must be called on the loop.'''
+        self._heap.clear()
+        if self._task != None:
+            self._task.cancel()
+            self._task = None
+
+    def pending(self) -> int:
+        '''Returns the number of jobs waiting to run.'''
+        return sum(1 for job in self._heap if not job.cancelled)
+
+    async def _run(self):
+        while True:
+            while len(self._heap) > 0 and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            if len(self._heap) == 0:
+                delay = self._MAX_SLEEP
+            else:
+                delay = self._heap[0].when - time.time()
+            if delay <= 0:
+                self._fire(heapq.heappop(self._heap))
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(delay, self._MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, job: ScheduledJob):
+        try:
+            result = job._callback(*job._args)
+            if asyncio.iscoroutine(result):
+                asyncio.get_running_loop().create_task(result)
+        except Exception as e:
+            print("Scheduled job failed:", e)
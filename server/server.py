@@ -1,6 +1,12 @@
-from typing import List
-import subprocess
-import queue
+from server.events import ServerEvents
+from server.console import ConsoleBuffer
+from server.timing import span
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, List, Tuple
+import threading
+import asyncio
+import time
 import os
 
 
@@ -19,6 +25,12 @@ class ServerRunner:
     args: `list[str]`
         A list of console arguments, such as -Xmx2G (You may need to add -server before some options)
         These arguments are parsed as java <args> -jar <jarname> -nogui
+    console: `ConsoleBuffer`
+        Where recent console output is kept, default is a new buffer (pass one in to keep history across restarts)
+    on_state_change: `Callable[[], None]`
+        Called whenever the process starts or exits, or the server becomes ready or stops being ready (from whichever thread caused it)
+    events: `ServerEvents`
+        Where events parsed from the console are recorded, default is a new one (pass one in to keep them across restarts)
 
     Attributes
     ----------
@@ -26,9 +38,18 @@ class ServerRunner:
         The absolute path to the server directory containing the jar file
     server_name: `str`
         The name of the server being run (note that this is not necessarily read from the config file)
+    console: `ConsoleBuffer`
+        The most recent console output
+    events: `ServerEvents`
+        The events seen in the console, such as players joining and lag warnings
+    boot_seconds: `float`
+        How long the last start took from launching the process to the server being ready, None until it is first ready
+    launch_error: `str`
+        Why the process couldn't be launched the last time start was called (e.g. java isn't installed), None if it was
     '''
 
-    def __init__(self, server_directory: str, server_name: str = None, jarname: str = "server.jar", args: List[str] = []):
+    def __init__(self, server_directory: str, server_name: str = None, jarname: str = "server.jar", args: List[str] = [],
+                 console: ConsoleBuffer = None, on_state_change: Callable[[], None] = None, events: ServerEvents = None):
         self._is_ready = False
         self.server_directory = os.path.abspath(server_directory)
         if (server_name == None):
@@ -37,56 +58,125 @@ class ServerRunner:
             self.server_name = server_name
         self._jarname = jarname
         self._args = args
-        self._server = None
-        self._listeners = set()
+        self._server: asyncio.subprocess.Process = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._listeners: Dict[object, _ListenerFeed] = {}
+        self._listeners_lock = threading.Lock()
+        self._exited = False
+        self.console = console if console != None else ConsoleBuffer()
+        self._on_state_change = on_state_change
+        self.events = events if events != None else ServerEvents()
+        self.boot_seconds: float = None
+        self.launch_error: str = None
+        self._started_at: float = None
+
+    # stdout is read this many bytes at a time and split into lines afterwards
+    _READ_CHUNK_SIZE = 1 << 16
 
     async def run(self):
         '''Alias to start.'''
         await self.start()
 
     async def start(self):
-        '''Start the server process if not already started.'''
+        '''
+        Start the server process if not already started.
+
+        If the process can't be launched, the reason is written to the console and kept in launch_error, and this returns.
+        '''
         if (self._server == None or not self.is_active()):
-            cmd = f"java "
-            for arg in self._args:
-                cmd += f"{arg} "
-            cmd += f"-jar {self._jarname} -nogui"
-            self._server = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True, cwd=self.server_directory)
+            self._loop = asyncio.get_running_loop()
+            # listeners added from here on follow the new process, rather than being closed as if the last one had just exited
+            with self._listeners_lock:
+                self._exited = False
+            self.launch_error = None
+            try:
+                self._server = await asyncio.create_subprocess_exec(*self._build_command(), stdout=asyncio.subprocess.PIPE,
+                                                                    stdin=asyncio.subprocess.PIPE, cwd=self.server_directory)
+            except OSError as e:  # java or the server directory is missing, or can't be run
+                self.launch_error = str(e)
+                self.console.append(f"[{datetime.now().strftime('%H:%M:%S')}] [Manager]: Failed to launch the server: {e}")
+                self._state_changed()
+                self._finish_listeners()
+                return
+            self._started_at = time.monotonic()
+            self._state_changed()
             await self._listen_for_logs()
 
+    def set_command(self, jarname: str, args: List[str]):
+        '''Changes the jar and java arguments, which take effect the next time the server is started.'''
+        self._jarname = jarname
+        self._args = args
+
+    def _build_command(self) -> List[str]:
+        '''Returns the command to run as java <args> -jar <jarname> -nogui.'''
+        return ["java"] + [arg for arg in self._args if arg != ""] + ["-jar", self._jarname, "-nogui"]
+
     async def _listen_for_logs(self):
         '''
         Monitors stdout for logs, reporting them to listeners.
 
-        This function should only be called once per server thread.
+        Output is read in large chunks and split into lines as it arrives, so bursts of logs are not read a line at a time.
+        This function should only be called once per server process.
         '''
-        while (self.is_active()):
-            try:
-                line = self._server.stdout.readline().decode().strip()
-            except ValueError:  # info->buf could be NUL
-                pass
-            else:
-                await self._update_listeners(line)
-                if not self._is_ready:
-                    await self._check_if_ready(line)
+        pending = b""
+        while True:
+            chunk = await self._server.stdout.read(self._READ_CHUNK_SIZE)
+            if not chunk:  # EOF, the process closed stdout
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            await self._handle_lines(lines)
+        if pending:
+            await self._handle_lines([pending])
+        await self._server.wait()
         # process is dead
         self._is_ready = False
         self._server = None
+        self.events.clear_players()
+        self._state_changed()
+        self._finish_listeners()
+
+    def _finish_listeners(self):
+        '''Passes the last of the output to every listener, then closes the ones that have a close method.'''
+        with self._listeners_lock:
+            feeds = list(self._listeners.values())
+            self._listeners.clear()
+            self._exited = True
+        last = self.console.next_seq - 1
+        for feed in feeds:
+            feed.finish(last)
 
-    async def _check_if_ready(self, msg: str):
-        if "INFO]: Done (" in msg:
+    async def _handle_lines(self, raw_lines: List[bytes]):
+        with span("runner.handle_lines"):
+            raw_lines = [raw_line.strip() for raw_line in raw_lines]
+            # the whole chunk goes into the console buffer at once, taking its lock once rather than per line
+            # listeners are updated from the buffer by the dispatcher thread, so a slow listener can't hold up reading
+            self.console.extend_raw(raw_lines)
+            events = self.events.feed(raw_lines)
+        for kind, value in events:
+            await self._handle_event(kind, value)
+
+    async def _handle_event(self, kind: str, value: object):
+        # both only ever come while booting, anything like them later on can only be something a player made the server print
+        if self._is_ready:
+            return
+        if kind == "ready":
             self._is_ready = True
-        elif "INFO]: You need to agree to the EULA" in msg:
+            self.boot_seconds = time.monotonic() - self._started_at
+            self._state_changed()
+        elif kind == "eula":
             self.kill()
 
-    async def _update_listeners(self, msg: str):
-        for listener in self._listeners:
-            listener.update(msg)
+    def _state_changed(self):
+        if self._on_state_change != None:
+            self._on_state_change()
 
     def add_listener(self, listener_object):
         '''
-        Subscribe the given object to be notified on this thread whenever there is a new message in the server console.
+        Subscribe the given object to be notified whenever there is a new message in the server console.
 
+        Each listener is updated in order from its own thread, reading from the console buffer rather than the server.
+        So a slow listener never holds up the server or other listeners, but it misses lines if it falls too far behind.
         The subscriber must contain the function "update(message: `str`)", otherwise throws AttributeError when adding listener.
         '''
         try:
@@ -94,12 +184,20 @@ class ServerRunner:
         except AttributeError:
             raise AttributeError("Listener does not contain update(message: str) attribute.")
         else:
-            self._listeners.add(listener_object)
+            with self._listeners_lock:
+                if listener_object not in self._listeners:
+                    feed = _ListenerFeed(self.console, listener_object, f"Listener-{self.server_name}")
+                    feed.start()
+                    if self._exited:  # nothing more is coming, so close it straight away
+                        feed.finish(feed._after)
+                    else:
+                        self._listeners[listener_object] = feed
 
     def remove_listener(self, listener_object):
         '''Unsubscribes an object from updates.'''
         try:
-            self._listeners.remove(listener_object)
+            with self._listeners_lock:
+                self._listeners.pop(listener_object).stop()
         except KeyError:
             pass
         else:
@@ -108,19 +206,51 @@ class ServerRunner:
             except AttributeError:
                 raise AttributeError("Listener does not contain update(message: str) attribute.")
 
+    def listener_backlogs(self) -> List[int]:
+        '''
+        Returns how far behind each listener is: the console lines not yet passed to it, plus those waiting in its queue
+        (for listeners with a stats method, like ServerListener).
+        '''
+        with self._listeners_lock:
+            feeds = list(self._listeners.values())
+        latest = self.console.next_seq - 1
+        backlogs = []
+        for feed in feeds:
+            backlog = max(0, latest - feed._after)
+            stats = getattr(feed._listener, "stats", None)
+            if stats != None:
+                backlog += stats()["queued"]
+            backlogs.append(backlog)
+        return backlogs
+
+    def pid(self) -> int:
+        '''Returns the process ID of the server (java itself, it is not run through a shell), or None if it isn't running.'''
+        server = self._server
+        return server.pid if server != None and server.returncode == None else None
+
     def is_active(self) -> bool:
-        '''Check if the server's thread is currently active (not necessarily that the server is running).'''
-        return self._server != None and self._server.poll() == None
+        '''Check if the server's process is currently active (not necessarily that the server is running).'''
+        return self._server != None and self._server.returncode == None
 
     def is_ready(self) -> bool:
         '''Check if the server is currently started, i.e. players are able to join.'''
         return self._is_ready
 
+    def _call_in_loop(self, callback, *args):
+        '''Runs the callback on the loop that owns the server process, since the process pipes are not thread safe.'''
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:  # called without async
+            running_loop = None
+        if running_loop == self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
     def write(self, command: str):
         '''Write a single line command to the server console. Newline automatically appended.'''
         try:
-            self._server.stdin.write(bytes(f"{command}\n", "utf-8"))
-            self._server.stdin.flush()
+            self._call_in_loop(self._server.stdin.write, bytes(f"{command}\n", "utf-8"))
         except Exception as e:
             print("Write failed:", e)
 
@@ -128,36 +258,147 @@ class ServerRunner:
         '''
         Stop the server, ALWAYS call this before closing the server (unless you've sent stop via rcon).
 
-        Note that is_restarting only changes the message that users see, and does not actually restart.
+        The stop command is sent and stdin is closed, this does not wait for the process to exit.
         '''
         try:
-            self._server.stdin.flush()
-            self._server.communicate(b"stop\n", timeout=5)
+            stdin = self._server.stdin
+            self._call_in_loop(self._send_stop, stdin)
         except Exception as e:
             print("Stop command failed:", e, "\n\t(Server may already be offline.)")
         finally:
             self._is_ready = False
+            self._state_changed()
+
+    def _send_stop(self, stdin: asyncio.StreamWriter):
+        if not stdin.is_closing():
+            stdin.write(b"stop\n")
+            stdin.close()
 
     def kill(self):
         '''Kills the server process. DO NOT RUN THIS UNLESS YOU ABSOLUTELY HAVE TO.'''
-        self._server.kill()
+        self._call_in_loop(self._server.kill)
         self._is_ready = False
+        self._state_changed()
+
+
+def _dropped_message(count: int) -> str:
+    '''The message standing in for lines that a listener missed.'''
+    return f"[{datetime.now().strftime('%H:%M:%S')}] [Obsidia]: {count} console lines dropped (listener fell behind)"
+
+
+class _ListenerFeed:
+    '''Passes new lines from a console buffer to one listener, on its own thread.'''
+
+    # how many lines are passed on at a time, and the longest to wait for more at once
+    _BATCH = 1000
+    _WAIT = 1
+
+    def __init__(self, console: ConsoleBuffer, listener, name: str):
+        self._console = console
+        self._listener = listener
+        self._name = name
+        self._after = console.next_seq - 1
+        self._stopped = False
+        self._final_seq: int = None
+
+    def start(self):
+        threading.Thread(target=self._run, name=self._name, daemon=True).start()
+
+    def stop(self):
+        '''Stops passing on lines, the thread finishes once the listener has taken the line it is on.'''
+        self._stopped = True
+        with self._console.condition:
+            self._console.condition.notify_all()
+
+    def finish(self, final_seq: int):
+        '''Passes on lines up to final_seq, then closes the listener (if it has a close method) and stops.'''
+        self._final_seq = final_seq
+        with self._console.condition:
+            self._console.condition.notify_all()
+
+    def _is_ending(self) -> bool:
+        return self._stopped or self._final_seq != None
+
+    def _run(self):
+        while not self._stopped:
+            if self._final_seq != None and self._after >= self._final_seq:
+                close = getattr(self._listener, "close", None)
+                if close != None:
+                    close()
+                return
+            lines, last = self._console.wait_after(self._after, self._WAIT, self._BATCH, self._is_ending)
+            if self._final_seq != None and last > self._final_seq:  # only what was written before the server exited
+                lines = lines[:len(lines) - (last - self._final_seq)]
+                last = self._final_seq
+            missed = last - self._after - len(lines)
+            if missed > 0:  # fell so far behind that the console buffer dropped lines before they were passed on
+                lines.insert(0, _dropped_message(missed))
+            self._after = last
+            with span("listener.update_batch"):
+                for line in lines:
+                    if self._stopped:
+                        return
+                    try:
+                        self._listener.update(line)
+                    except Exception as e:
+                        print(f"{self._name} failed:", e)
+
+
+class _Dropped:
+    '''Stands in for a run of dropped messages in a ServerListener's queue.'''
+
+    def __init__(self):
+        self.count = 0
 
 
 class ServerListener:
     '''
     Listens to a given server and creates a queue that can be queried for messages.
-    Automatically subscribes to the server passed as parameter.
+    Automatically subscribes to the server passed as parameter, and is closed once the server's process exits.
+
+    The queue holds at most capacity messages, what happens to messages that arrive when it is full depends on overflow:
+        "drop_oldest" - the oldest queued message is discarded to make room
+        "drop_newest" - the new message is discarded
+        "coalesce" - new messages are discarded, and a single "N console lines dropped" message takes their place
+
+    Messages can be waited for with get or drain, or by iterating over the listener (with for or async for),
+    which ends once the listener is closed and every message has been taken.
 
     Parameters
     ----------
     server: `ServerRunner`
         The server to listen to
+    capacity: `int`
+        The most messages queued at once
+    overflow: `str`
+        What to do with messages that arrive when the queue is full, default "coalesce"
+
+    Attributes
+    ----------
+    received: `int`
+        How many messages the server has passed to this listener
+    delivered: `int`
+        How many messages have been taken from the queue (not counting dropped line messages)
+    dropped: `int`
+        How many messages were discarded because the queue was full
     '''
 
-    def __init__(self, server: ServerRunner):
+    OVERFLOW_POLICIES = ["drop_oldest", "drop_newest", "coalesce"]
+
+    def __init__(self, server: ServerRunner, capacity: int = 10000, overflow: str = "coalesce"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, expected one of {', '.join(self.OVERFLOW_POLICIES)}")
         self._server = server
-        self._message_queue = queue.Queue()
+        self._capacity = max(1, capacity)
+        self._overflow = overflow
+        self._message_queue: Deque = deque()
+        self._condition = threading.Condition()
+        # futures of async iterators waiting for a message, with the loops they belong to
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._closed = False
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
         self.subscribe()
 
     def subscribe(self):
@@ -168,20 +409,111 @@ class ServerListener:
         '''Unsubscribes from the server's listener pool.'''
         self._server.remove_listener(self)
 
+    def close(self):
+        '''Unsubscribes and wakes anything waiting for messages, messages already queued can still be taken.'''
+        self.unsubscribe()
+        with self._condition:
+            self._closed = True
+            self._wake()
+
+    @property
+    def closed(self) -> bool:
+        '''True once the listener has been closed, which happens by itself when the server's process exits.'''
+        return self._closed
+
     def update(self, message: str):
-        self._message_queue.put(message)
+        with self._condition:
+            self.received += 1
+            queue = self._message_queue
+            if len(queue) >= self._capacity:
+                self.dropped += 1
+                if self._overflow == "drop_newest":
+                    return
+                elif self._overflow == "coalesce":
+                    # the marker may go one over capacity, after that it just counts
+                    if len(queue) == 0 or not isinstance(queue[-1], _Dropped):
+                        queue.append(_Dropped())
+                    queue[-1].count += 1
+                    return
+                else:
+                    queue.popleft()
+            queue.append(message)
+            self._wake()
+
+    def _wake(self):
+        '''Wakes everything waiting for a message, must hold the condition.'''
+        self._condition.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters.clear()
+
+    def _pop(self) -> str:
+        '''Takes the first message in the queue, must hold the condition and the queue must not be empty.'''
+        message = self._message_queue.popleft()
+        if isinstance(message, _Dropped):
+            return _dropped_message(message.count)
+        self.delivered += 1
+        return message
 
     def next(self) -> str:
         '''Returns the first message in the queue, or None if empty.'''
-        if (self._message_queue.empty()):
-            return None
-        else:
-            # it's possible to pass an empty check but not have an item, this causes a block until an item is added (hence timeout w/ try)
-            try:
-                return self._message_queue.get(timeout=1)
-            except queue.Empty:
+        with self._condition:
+            if len(self._message_queue) == 0:
+                return None
+            return self._pop()
+
+    def get(self, timeout: float = None) -> str:
+        '''Waits up to timeout seconds (forever if None) for a message and returns it, or None if there wasn't one or the listener is closed.'''
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._message_queue) > 0 or self._closed, timeout)
+            if len(self._message_queue) == 0:
                 return None
+            return self._pop()
+
+    def drain(self, max_n: int = None, timeout: float = 0) -> List[str]:
+        '''
+        Returns up to max_n (all if None) of the queued messages at once.
+
+        If the queue is empty, waits up to timeout seconds (forever if None) for a message first.
+        '''
+        with self._condition:
+            if timeout != 0:
+                self._condition.wait_for(lambda: len(self._message_queue) > 0 or self._closed, timeout)
+            count = len(self._message_queue) if max_n == None else min(max_n, len(self._message_queue))
+            return [self._pop() for _ in range(count)]
 
     def has_next(self) -> bool:
         '''Returns true if there is a message in queue, false otherwise.'''
-        return not self._message_queue.empty()
+        return len(self._message_queue) > 0
+
+    def stats(self) -> Dict[str, int]:
+        '''Returns how many messages were received, delivered, and dropped, and how many are queued.'''
+        with self._condition:
+            return {"received": self.received, "delivered": self.delivered, "dropped": self.dropped, "queued": len(self._message_queue)}
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            message = self.get()
+            if message == None:
+                return
+            yield message
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        while True:
+            with self._condition:
+                if len(self._message_queue) > 0:
+                    return self._pop()
+                if self._closed:
+                    raise StopAsyncIteration
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
@@ -1,14 +1,44 @@
-from config.configs import MCPropertiesParser, ObsidiaConfigParser
+from server.backup_coordinator import BackupCoordinator, get_coordinator
+from server.config_watcher import get_config_watcher
+from server.supervisor import ServerSupervisor, get_supervisor
+from server.scheduler import ScheduledJob
+from config.configs import MCPropertiesParser, get_config
 from server.server import ServerRunner
+from server.console import ConsoleBuffer
+from server.events import ServerEvents
+from server.log_index import LogIndex, get_index_updater
+from server.logs import LogReader
+from server.timing import timed
+from server import backups
+from concurrent.futures import Future
+from collections import deque
 from datetime import datetime
-from typing import List
+from typing import Deque, Dict, List, Tuple
 import threading
+import hashlib
+import json
 import asyncio
 import shutil
 import time
 import os
 
 
+class _StopWatcher:
+    '''Watches the console of a stopping server for it saving the world.'''
+
+    def __init__(self, saving_message: str, saved_message: str):
+        self._saving_message = saving_message
+        self._saved_message = saved_message
+        self.saving = False
+        self.saved_at: float = None
+
+    def update(self, message: str):
+        if self._saving_message in message:
+            self.saving = True
+        elif self._saved_message in message and self.saved_at == None:
+            self.saved_at = time.monotonic()
+
+
 class ServerManager:
     '''
     Create and run a server given the directory.
@@ -19,6 +49,10 @@ class ServerManager:
         The directory of the server, the server's jar and server.properties should be one layer below (e.g. server_directory/server.jar)
     config_file: `str`
         The basename of the config file for the server manager, default "obsidia.conf"
+    supervisor: `ServerSupervisor`
+        The supervisor whose loop runs the server, default is the one shared by the whole process
+    coordinator: `BackupCoordinator`
+        The coordinator that background backups wait on, default is the one shared by the whole process
 
     Attributes
     ----------
@@ -29,16 +63,46 @@ class ServerManager:
         The config file in use
     server_directory: `str`
         The absolute path to the server directory containing the jar file
+    console: `ConsoleBuffer`
+        The most recent console output, kept across restarts
+    events: `ServerEvents`
+        Who is online and the trends of events in the console (lag warnings, exceptions, etc.), kept across restarts
+    log_index: `LogIndex`
+        The search index of the server's logs, kept up to date in the background if index_logs is on
     '''
 
-    def __init__(self, server_directory: str, config_file: str = "obsidia.conf"):
+    def __init__(self, server_directory: str, config_file: str = "obsidia.conf", supervisor: ServerSupervisor = None,
+                 coordinator: BackupCoordinator = None):
         self.server_directory = os.path.abspath(server_directory)
         self.config_file = os.path.join(self.server_directory, config_file)
         self.server: ServerRunner = None
-        self._server_thread: threading.Thread = None
-        self._monitor_thread: threading.Thread = None
+        self.console = ConsoleBuffer()
+        self.events = ServerEvents(on_players_change=self._refresh_status)
+        self._supervisor = supervisor if supervisor != None else get_supervisor()
+        self._coordinator = coordinator if coordinator != None else get_coordinator()
+        self._server_task: asyncio.Task = None
+        self._scheduled_jobs: Dict[str, ScheduledJob] = {}
+        # the slot the scheduled backup is for, and one whose backup was still waiting to start when the server last went down
+        self._backup_time: float = None
+        self._missed_backup_time: float = None
+        self._backup_lock = threading.RLock()
+        self._backup_job: backups.BackupJob = None
+        self._backup_jobs: Dict[str, backups.BackupJob] = {}
+        self._restore_lock = threading.Lock()
+        self._log_reader = LogReader(os.path.join(self.server_directory, "logs", "latest.log"))
+        self.log_index = LogIndex(os.path.join(self.server_directory, "logs"))
+        self._prepared_restore: str = None
         self._server_should_be_running = False
+        self._status_lock = threading.Lock()
+        self._status: Dict = None
+        self._status_etag: str = None
+        self._restarts = 0
+        self._crash_restarts = 0
+        self._recent_crashes: Deque[float] = deque()
+        self._configs_loaded = False
         self._reset_server_startup_vars()
+        get_config_watcher(self._supervisor).watch(get_config(self.config_file), self._config_changed)
+        self._supervisor.scheduler.call_later(0, self._update_log_index)
 
     def _reset_server_startup_vars(self):
         '''Initial vars are those that need to be reset every time the server is launched, NOT threads or the like.'''
@@ -59,175 +123,429 @@ class ServerManager:
     def stop_server(self):
         '''Sends a stop command to the server.'''
         self._sent_stop_signal = True
-        self.server.stop()
+        if self.server != None:
+            self.server.stop()
+
+    # console output showing that a stopping server is saving the world, and that it has finished
+    _SAVING_MESSAGE = "Saving chunks"
+    _SAVED_MESSAGE = "All dimensions are saved"
+    # how long a server that has finished saving gets to exit before it is killed, in seconds
+    _SAVED_GRACE = 10
+
+    async def stop_and_wait(self, stop_timeout: float = 30, save_timeout: float = 300, kill_timeout: float = 10) -> str:
+        '''
+        Stops the server and waits for it to exit, killing it if it won't. Must be run on the supervisor's loop.
+
+        The server has stop_timeout seconds to exit, or save_timeout seconds if it has started saving the world.
+        Once it reports that everything is saved it has a few seconds left to exit, then it is killed and given kill_timeout seconds to die.
+
+        Return
+        ------
+        "stopped" if the server exited by itself, "killed" if it had to be killed, "stuck" if it didn't die even then,
+        or "offline" if it wasn't running
+        '''
+        task = self._server_task
+        if task == None or task.done():
+            self.stop_server()
+            return "offline"
+        watcher = _StopWatcher(self._SAVING_MESSAGE, self._SAVED_MESSAGE)
+        self.server.add_listener(watcher)
+        try:
+            self.stop_server()
+            started = time.monotonic()
+            while not task.done():
+                if watcher.saved_at != None:
+                    deadline = min(started + save_timeout, watcher.saved_at + self._SAVED_GRACE)
+                elif watcher.saving:
+                    deadline = started + save_timeout
+                else:
+                    deadline = started + stop_timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # wakes up on exit, and now and then to notice saving progress
+                await asyncio.wait([task], timeout=min(remaining, 0.5))
+            if task.done():
+                return "stopped"
+            self._update_server_listeners("Server didn't stop in time: Killing")
+            self.server.kill()
+            await asyncio.wait([task], timeout=kill_timeout)
+            return "killed" if task.done() else "stuck"
+        finally:
+            self.server.remove_listener(watcher)
 
     def restart_server(self):
         '''Sends a stop command to the server, but restarts.'''
         self._is_autorestarting = True
         self.server.stop()
 
-    def start_server(self):
-        '''Creates a new thread to run the server in and a thread to monitor it for crashing/backups/etc.'''
+    def start_server(self) -> Future:
+        '''
+        Runs the server and a task to monitor it for crashing/backups/etc. on the supervisor's loop.
+
+        Returns a future that completes once the server should no longer be running.
+        '''
         self._server_should_be_running = True
-        self.server = ServerRunner(self.server_directory, server_name=self.get_name(), jarname=self._server_jar, args=self._args)
-        self._spawn_server_thread()
-        self._spawn_monitor_thread()
+        self.server = ServerRunner(self.server_directory, server_name=self.get_name(), jarname=self._server_jar, args=self._args,
+                                   console=self.console, on_state_change=self._refresh_status, events=self.events)
+        self._refresh_status()
+        return self._supervisor.submit(self._running_loop())
 
-    def _spawn_server_thread(self):
+    def _spawn_server_task(self):
         self._server_start_time = self._get_current_time()
-        self._server_thread = threading.Thread(target=self._asynced_server_start, name=f"ServerThread")
-        self._server_thread.start()
-
-    def _spawn_monitor_thread(self):
-        self._monitor_thread = threading.Thread(target=self._asynced_running_loop_start, name=f"MonitorThread")
-        self._monitor_thread.start()
-
-    def _asynced_server_start(self):
-        asyncio.run(self.server.start())
-
-    def _asynced_running_loop_start(self):
-        asyncio.run(self._running_loop())
+        self._server_task = asyncio.get_running_loop().create_task(self.server.start())
 
     async def _running_loop(self):
+        self._spawn_server_task()
         while (self.server_should_be_running()):
-            time_until_restart = self._get_offset_until(self._autorestart_datetime)
-            time_until_backup = self._get_offset_until(self._backup_datetime)
-            while (self.server_thread_running()):
-                await asyncio.sleep(5)  # longer causes high delay between server shutdown and server appearing shut down in _server_should_be_running
-
-                if self._do_autorestart:
-                    new_time_until_restart = self._get_offset_until(self._autorestart_datetime)
-                    if new_time_until_restart > time_until_restart:  # passed timestamp, it's sending next occurrence
-                        self.write("say Restarting now!")
-                        self._is_autorestarting = True
-                        self.server.stop()
-                    elif new_time_until_restart <= 60 and time_until_restart > 60:
-                        self.write("say Restarting in 60 seconds!")
-                    elif new_time_until_restart <= 300 and time_until_restart > 300:
-                        self.write("say Restarting in 5 minutes.")
-                    elif new_time_until_restart <= 900 and time_until_restart > 900:
-                        self.write("say Restarting in 15 minutes.")
-                    time_until_restart = new_time_until_restart
-
-                if self._do_backups:
-                    new_time_until_backup = self._get_offset_until(self._backup_datetime)
-                    if new_time_until_backup > time_until_backup:  # passed timestamp, it's sending next occurrence
-                        self.backup_world()
-                    time_until_backup = new_time_until_backup
+            self._schedule_jobs()
+            await asyncio.wait([self._server_task])
+            self._cancel_jobs()
 
             # clean up after the server closes based on whether or not we need to restart
-            if self._is_autorestarting:
+            if self.server.launch_error != None:  # it never ran, so it isn't a crash, and trying again won't help
+                self._server_should_be_running = False
+            elif self._is_autorestarting:
+                self._restarts += 1
                 self._update_server_listeners("Automatically restarting")
                 self._reset_server_startup_vars()
-                await self._spawn_server_thread()
+                self._spawn_server_task()
             elif self._restart_on_crash and not self._sent_stop_signal:
-                self._update_server_listeners("Detected server crash: Restarting")
+                delay = self._crash_restart_delay()
+                if delay == None:
+                    self._update_server_listeners(f"Detected server crash: Already restarted {self._MAX_CRASH_RESTARTS} times in the "
+                                                  f"last {self._CRASH_WINDOW // 60} minutes, not restarting again")
+                    self._server_should_be_running = False
+                    continue
+                self._update_server_listeners(f"Detected server crash: Restarting in {delay:.0f} seconds")
+                await asyncio.sleep(delay)
+                if self._sent_stop_signal:  # stopped while waiting
+                    self._server_should_be_running = False
+                    continue
+                self._crash_restarts += 1
                 self._reset_server_startup_vars()
-                await self._spawn_server_thread()
+                self._spawn_server_task()
             else:
                 self._server_should_be_running = False
+        self._refresh_status()
+
+    # crash restarts wait this many seconds, doubling for each crash in the last _CRASH_WINDOW seconds up to the max
+    _CRASH_RESTART_DELAY = 5
+    _MAX_CRASH_RESTART_DELAY = 300
+    # a server that crashes this many times within _CRASH_WINDOW seconds is left stopped
+    _MAX_CRASH_RESTARTS = 5
+    _CRASH_WINDOW = 1800
+
+    def _crash_restart_delay(self) -> float:
+        '''Records a crash, returning how long to wait before restarting, or None if it has crashed too often to restart.'''
+        now = time.monotonic()
+        while len(self._recent_crashes) > 0 and self._recent_crashes[0] < now - self._CRASH_WINDOW:
+            self._recent_crashes.popleft()
+        self._recent_crashes.append(now)
+        if len(self._recent_crashes) > self._MAX_CRASH_RESTARTS:
+            self._recent_crashes.clear()
+            return None
+        return min(self._CRASH_RESTART_DELAY * 2 ** (len(self._recent_crashes) - 1), self._MAX_CRASH_RESTART_DELAY)
+
+    # warnings sent to players before an autorestart, as (seconds before restart, command)
+    _RESTART_WARNINGS = [
+        (900, "say Restarting in 15 minutes."),
+        (300, "say Restarting in 5 minutes."),
+        (60, "say Restarting in 60 seconds!"),
+    ]
+
+    def _schedule_jobs(self):
+        '''Schedules the restart warnings, restart, and backup for the current server run.'''
+        scheduler = self._supervisor.scheduler
+        now = time.time()
+        if self._do_autorestart:
+            restart_time = self._autorestart_schedule.next_fire(now)
+            if restart_time != None:
+                for seconds, command in self._RESTART_WARNINGS:
+                    if restart_time - seconds > now:
+                        self._scheduled_jobs[command] = scheduler.call_at(restart_time - seconds, self.write, command)
+                self._scheduled_jobs["restart"] = scheduler.call_at(restart_time, self._autorestart)
+        if self._do_backups:
+            if self._missed_backup_time != None:
+                # the last run ended while a backup was waiting out its stagger delay, so it is picked up from its own slot
+                self._schedule_backup(self._missed_backup_time - 1)
+            else:
+                self._schedule_backup(now)
+        self._missed_backup_time = None
+
+    def _schedule_backup(self, after: float):
+        backup_time = self._backup_schedule.next_fire(after)
+        self._backup_time = backup_time
+        if backup_time != None:
+            # servers scheduled for the same time are spread out so they don't all hit the disk at once
+            fire_time = backup_time + self._coordinator.stagger_delay(self.server_directory)
+            self._scheduled_jobs["backup"] = self._supervisor.scheduler.call_at(fire_time, self._scheduled_backup, backup_time)
+
+    def _cancel_jobs(self):
+        backup_job = self._scheduled_jobs.get("backup")
+        if backup_job != None and not backup_job.cancelled and self._backup_time <= time.time():
+            self._missed_backup_time = self._backup_time
+        for job in self._scheduled_jobs.values():
+            job.cancel()
+        self._scheduled_jobs.clear()
+
+    def _autorestart(self):
+        self.write("say Restarting now!")
+        self._is_autorestarting = True
+        self.server.stop()
+
+    def _scheduled_backup(self, backup_time: float):
+        self._schedule_backup(backup_time)
+        self.start_backup()
+
+    def _update_log_index(self):
+        '''Queues an update of the log index every index_interval seconds, while index_logs is on.'''
+        self._supervisor.scheduler.call_later(self._index_interval, self._update_log_index)
+        # indexing a backlog of rotated logs can take a while, so it is kept off the loop
+        if self._index_logs:
+            get_index_updater().submit(self.log_index)
 
     def _get_current_time(self) -> int:
         return int(time.time())
 
-    def _get_offset_until(self, timestamp: str) -> int:
-        '''Parse SMTWRFD HHMM timestamp and check how far away it is from now, in seconds.'''
-        offset = 0
-        current_time = datetime.now()
-        timestamp_parts = timestamp.split(" ")
-        days = timestamp_parts[0]
-        hour = int(timestamp_parts[1][:2])
-        mins = int(timestamp_parts[1][2:])
-        offset += (hour - current_time.hour) * 3600
-        offset += (mins - current_time.minute) * 60
-        offset -= current_time.second
-        current_day_num = (current_time.weekday() + 1) % 7
-        for i in range(14 - current_day_num):  # 14 not 7 because we have to account for wrapping if we skip the one day a week it runs
-            # check offset < 0 because we need to skip if we already passed the timestamp on the first day checked (today)
-            if "SMTWRFDSMTWRFD"[current_day_num + i] not in days or offset < 0:
-                offset += 86400
-            else:
-                break
-        return offset
+    # how many backup and verify jobs to remember for get_backup_job
+    _BACKUP_JOB_HISTORY = 10
+
+    def start_backup(self) -> backups.BackupJob:
+        '''
+        Starts a backup of the world in the background, returning its job to track progress.
+
+        The backup waits for the coordinator to allow it to run, and is speed limited by it.
+        If a backup is already running or queued, its job is returned instead of starting another.
+        '''
+        with self._backup_lock:
+            if self._backup_job != None and not self._backup_job.is_finished():
+                return self._backup_job
+            job = backups.BackupJob()
+            self._backup_job = job
+            self._track_job(job)
+        # threads take after the one starting them, which is usually a daemon (a web request or the loop), but Obsidia has to
+        # wait for this to finish before exiting or the backup is left half written
+        threading.Thread(target=self._run_backup_job, args=(job,), name=f"Backup-{self.get_name()}", daemon=False).start()
+        self._refresh_status()
+        return job
+
+    def _run_backup_job(self, job: backups.BackupJob):
+        with self._coordinator.slot(job):
+            self.backup_world(job)
+
+    def _track_job(self, job: backups.BackupJob):
+        with self._backup_lock:
+            self._backup_jobs[job.job_id] = job
+            while len(self._backup_jobs) > self._BACKUP_JOB_HISTORY:
+                del self._backup_jobs[next(iter(self._backup_jobs))]
+
+    def get_backup_job(self, job_id: str = None) -> backups.BackupJob:
+        '''Returns the backup or verify job with the given ID (or the latest job if None), or None if there is no such job.'''
+        with self._backup_lock:
+            if job_id == None:
+                return next(reversed(list(self._backup_jobs.values())), None)
+            return self._backup_jobs.get(job_id)
+
+    @timed("manager.backup_world")
+    def backup_world(self, job: backups.BackupJob = None) -> backups.BackupJob:
+        '''
+        Creates a backup of the world in the backup directory, deleting older backups to maintain max.
 
-    def backup_world(self):
-        '''Creates a backup of the world in the backup directory, deleting older backups to maintain max.'''
+        This blocks until the backup is done, use start_backup to run it in the background.
+        '''
+        if job == None:
+            job = backups.BackupJob()
         self._update_server_listeners("Backing up world")
-        # turn off autosaving while doing the backup to prevent conflicts, but server might be off already so try/except
-        if self.server.is_ready():
-            try:
-                self.write("save-off")
-            except Exception:
-                pass
-        if self._max_backups > 0:
-            # hacky way to check which backups were created automatically and use the timestamp name
-            backup_list = self.list_backups()
-            total_backups = 0
-            oldest_backup = 1000000000000000000000  # eh good enough
-            for backup in backup_list:
-                try:
-                    backup = int(backup)
-                except:
-                    pass
-                else:
-                    oldest_backup = min(backup, oldest_backup)
-                    total_backups += 1
-            if total_backups >= self._max_backups:
-                self._delete_world(os.path.join(self._backup_directory, f"{oldest_backup}"))
-        # alright, now we can backup
         world_dir = os.path.join(self.server_directory, self._level_name)
-        backup_dir = os.path.join(self._backup_directory, f"{self._get_current_time()}")
+        backup_name = f"{self._get_current_time()}"
+        error = None
+        saving_disabled = False
         try:
-            self._copy_world(world_dir, backup_dir)
+            # turn off autosaving while doing the backup to prevent conflicts
+            if self.server_active():
+                self.write("save-off")
+                saving_disabled = True
+            job.start(*backups.measure(world_dir))
+            # full copies are large, so make room before copying, incremental snapshots need the previous one to link against
+            if self._backup_mode == "full":
+                self._prune_backups(self._max_backups - 1)
+            previous_backup = self._latest_backup()
+            previous_manifest = backups.read_backup_manifest(self._backup_directory, os.path.basename(previous_backup)) if previous_backup != None else None
+            if self._backup_mode == "archive":
+                backup_name += backups.ARCHIVE_FORMATS[self._archive_format]
+            job.backup = backup_name
+            backup_dir = os.path.join(self._backup_directory, backup_name)
+            info = {}
+            with backups.FileManifest(backup_dir, previous_manifest) as file_manifest:
+                if self._backup_mode == "incremental":
+                    backups.copy_incremental(world_dir, backup_dir, previous_backup, job, file_manifest)
+                elif self._backup_mode == "chunked":
+                    backups.copy_chunked(world_dir, backup_dir, self._chunk_store(), previous_backup, job, file_manifest)
+                elif self._backup_mode == "archive":
+                    os.makedirs(self._backup_directory, exist_ok=True)
+                    info = backups.archive_world(world_dir, backup_dir, self._archive_format, self._compression_level,
+                                                 self._compression_workers, job, file_manifest)
+                else:
+                    backups.copy_full(world_dir, backup_dir, job, file_manifest)
+                manifest = file_manifest.to_dict()
+            backups.write_backup_manifest(self._backup_directory, backup_name, manifest)
+            backups.write_backup_info(self._backup_directory, backup_name, info)
+            self._prune_backups(self._max_backups)
         except Exception as e:
-            self._update_server_listeners(f"Failed to back up world: {e}")
-        # turn back on autosaving
-        # NOTE: should probably save the initial state of it and set it back to that, rather than forcing it on (config?)
-        if self.server.is_ready():
-            try:
+            error = str(e)
+        finally:
+            # turn autosaving back on even if the backup failed
+            # NOTE: should probably save the initial state of it and set it back to that, rather than forcing it on (config?)
+            if saving_disabled:
                 self.write("save-on")
-            except Exception:
-                pass
-        self._update_server_listeners("Backup completed")
+        job.finish(error)
+        self._refresh_status(backups_changed=True)
+        if error != None:
+            self._update_server_listeners(f"Failed to back up world: {error}")
+        else:
+            self._update_server_listeners("Backup completed")
+        return job
+
+    def _latest_backup(self) -> str:
+        '''Returns the path of the newest automatic backup, or None if there are none.'''
+        automatic_backups = backups.timestamped_backups(self.list_backups())
+        if len(automatic_backups) == 0:
+            return None
+        return os.path.join(self._backup_directory, automatic_backups[-1])
+
+    def _prune_backups(self, keep: int):
+        '''Deletes the oldest automatic backups until at most keep remain, unless max_backups is disabled.'''
+        if self._max_backups <= 0:
+            return
+        automatic_backups = backups.timestamped_backups(self.list_backups())
+        expired_backups = automatic_backups[:max(len(automatic_backups) - keep, 0)]
+        for backup in expired_backups:
+            backups.delete_backup(self._backup_directory, backup)
+        if len(expired_backups) > 0 and os.path.isdir(self._chunk_store()):
+            backups.collect_chunks(self._chunk_store(), [os.path.join(self._backup_directory, backup) for backup in self.list_backups()])
+
+    def _chunk_store(self) -> str:
+        '''The directory that chunked backups store region file chunks in.'''
+        return os.path.join(self._backup_directory, ".chunks")
 
     def list_backups(self) -> List[str]:
         '''Returns a list of world backups.'''
         try:
-            return os.listdir(self._backup_directory)
+            return [backup for backup in os.listdir(self._backup_directory) if not backup.startswith(".")]
         except FileNotFoundError:
             return ""
 
+    def get_backup_info(self, backup: str) -> Dict:
+        '''
+        Returns recorded details of a backup, or an empty dict if there are none.
+
+        Archives record their uncompressed "bytes" and compressed "stored_bytes" (the size and hash of each file are kept
+        separately, see backups.read_backup_manifest).
+        '''
+        return backups.read_backup_info(self._backup_directory, backup)
+
+    def verify_backup(self, backup: str, job: backups.BackupJob = None) -> Dict:
+        '''
+        Checks that a backup matches the manifest recorded when it was made, returning what was found (see backups.verify_backup).
+
+        Fails if the specified backup does not exist, or has no manifest.
+        '''
+        if backup not in self.list_backups():
+            raise FileNotFoundError("Specified backup does not exist.")
+        if job == None:
+            job = backups.BackupJob("verify")
+        job.backup = backup
+        return backups.verify_backup(os.path.join(self._backup_directory, backup),
+                                     backups.read_backup_manifest(self._backup_directory, backup), self._chunk_store(), job)
+
+    def start_verify(self, backup: str) -> backups.BackupJob:
+        '''Starts verifying a backup in the background, returning its job (the findings are in the job's result).'''
+        job = backups.BackupJob("verify")
+        job.backup = backup
+        self._track_job(job)
+        threading.Thread(target=self._run_verify_job, args=(job,), name=f"Verify-{self.get_name()}", daemon=False).start()
+        return job
+
+    def _run_verify_job(self, job: backups.BackupJob):
+        with self._coordinator.slot(job):
+            error = None
+            try:
+                job.result = self.verify_backup(job.backup, job)
+            except Exception as e:
+                error = str(e)
+            job.finish(error)
+        self._refresh_status()
+
+    def prepare_restore(self, backup: str):
+        '''
+        Copies a backup next to the live world, ready for restore_backup to swap in.
+
+        The live world isn't touched, so this can be done while the server is running to keep downtime short.
+        Fails if the specified backup does not exist.
+        '''
+        if backup not in self.list_backups():
+            raise FileNotFoundError("Specified backup does not exist.")
+        with self._restore_lock:
+            self._prepared_restore = None
+            staging_dir = self._staging_world()
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
+            backups.restore_snapshot(os.path.join(self._backup_directory, backup), staging_dir, self._chunk_store())
+            self._prepared_restore = backup
+        self._refresh_status()
+
+    def start_prepare_restore(self, backup: str):
+        '''Runs prepare_restore in the background.'''
+        threading.Thread(target=self.prepare_restore, args=(backup,), name=f"PrepareRestore-{self.get_name()}", daemon=False).start()
+
+    def get_prepared_restore(self) -> str:
+        '''Returns the backup that has been prepared by prepare_restore, or None.'''
+        return self._prepared_restore
+
     def restore_backup(self, backup: str):
         '''
         Restores a backup from a specified timestamp.
 
+        The backup is prepared next to the live world (unless prepare_restore already did so) and swapped in by renaming.
+        The replaced world is kept as <level-name>.rollback, and the rollback before that is deleted in the background.
         Fails if the server is currently running, or if the specified backup does not exist.
-        (Note that only the existance of the directory pointed to is checked. It may be empty.)
         '''
         if self.server_should_be_running():
             raise RuntimeError("Cannot restore backup while server is running.")
-        backup_list = self.list_backups()
-        if backup in backup_list:
-            world_dir = os.path.join(self.server_directory, self._level_name)
-            backup_dir = os.path.join(self._backup_directory, backup)
-            self._delete_world(world_dir)
-            self._copy_world(backup_dir, world_dir)
-        else:
-            raise FileNotFoundError("Specified backup does not exist.")
+        if self._prepared_restore != backup or not os.path.isdir(self._staging_world()):
+            self.prepare_restore(backup)
+        with self._restore_lock:
+            self._swap_in_world(self._staging_world())
+            self._prepared_restore = None
+        self._refresh_status()
 
-    def _copy_world(self, source, destination):
-        shutil.copytree(source, destination, ignore=shutil.ignore_patterns("*.lock"))
+    def _staging_world(self) -> str:
+        return os.path.join(self.server_directory, self._level_name + ".restoring")
 
-    def _delete_world(self, world):
-        shutil.rmtree(world)
+    def _rollback_world(self) -> str:
+        return os.path.join(self.server_directory, self._level_name + ".rollback")
+
+    def _swap_in_world(self, staging_dir: str):
+        '''Replaces the live world with staging_dir using renames, so the world is never half copied.'''
+        world_dir = os.path.join(self.server_directory, self._level_name)
+        rollback_dir = self._rollback_world()
+        if os.path.exists(rollback_dir):
+            # get the old rollback out of the way instantly, deleting it can take a while
+            trash_dir = os.path.join(self.server_directory, f".{self._level_name}.trash-{self._get_current_time()}")
+            os.rename(rollback_dir, trash_dir)
+            threading.Thread(target=shutil.rmtree, args=(trash_dir, True), name=f"DeleteWorld-{self.get_name()}", daemon=False).start()
+        if os.path.exists(world_dir):
+            os.rename(world_dir, rollback_dir)
+        os.rename(staging_dir, world_dir)
 
     def server_should_be_running(self) -> bool:
         '''Returns true if the server should be running (but might be restarting), false otherwise.'''
         return self._server_should_be_running
 
-    def server_thread_running(self) -> bool:
-        '''Returns true if the server's thread is currently running, false otherwise.'''
-        return self._server_thread != None and self._server_thread.is_alive()
+    def server_task_running(self) -> bool:
+        '''Returns true if the server's task is currently running, false otherwise.'''
+        return self._server_task != None and not self._server_task.done()
 
     def server_active(self) -> bool:
         '''Returns true if the server is active and ready to take commands.'''
@@ -245,41 +563,164 @@ class ServerManager:
 
     def _update_server_listeners(self, message: str):
         timestamp = f"[{datetime.now().strftime('%H:%M:%S')}] [Manager]: "
-        # headache: since the loop gets stuck in monitoring, it couldn't run this task
-        # to fix: make sure that the monitor has an awaitable that lets other tasks go
-        try:
-            asyncio.get_running_loop().create_task(self.server._update_listeners(timestamp + message))
-        except RuntimeError:  # called without async
-            pass
+        self.console.append(timestamp + message)
+
+    _BACKUP_MODES = ["full", "incremental", "chunked", "archive"]
 
     def reload_configs(self):
-        '''Reload the configs from the current config file.'''
-        config = ObsidiaConfigParser(os.path.join(self.server_directory, self.config_file))
+        '''
+        Reload the configs from the current config file (the file is only read again if it has changed).
+
+        Nothing is changed unless every option is valid. The server name is only read the first time, since servers are known
+        by it (e.g. in the registry) until Obsidia is restarted.
+        '''
+        config = get_config(os.path.join(self.server_directory, self.config_file))
+        config.reload_if_changed()
 
         # NOTE: the config items could be None or invalid in some cases, but crashing is fine in these circumstances
         try:
-            self._server_jar = config.get("Server Information", "server_jar")
-            self._server_name = config.get("Server Information", "server_name")
-            if self._server_name == "":
-                self._server_name = None
-            self._args = config.get("Server Information", "args").split(" ")
-
-            self._do_autorestart = config.get("Restarts", "autorestart").lower() == "true"
-            self._autorestart_datetime = config.get("Restarts", "autorestart_datetime")
-            self._restart_on_crash = config.get("Restarts", "restart_on_crash").lower() == "true"
-
-            self._do_backups = config.get("Backups", "backup").lower() == "true"
-            self._max_backups = int(config.get("Backups", "max_backups"))
-            self._backup_datetime = config.get("Backups", "backup_datetime")
-            self._backup_directory = os.path.join(self.server_directory, config.get("Backups", "backup_folder"))
-
-            config.write()
+            server_jar = config.get("Server Information", "server_jar")
+            server_name = config.get("Server Information", "server_name")
+            if server_name == "":
+                server_name = None
+            args = config.get("Server Information", "args").split(" ")
+
+            do_autorestart = config.get_bool("Restarts", "autorestart")
+            autorestart_schedule = config.get_schedule("Restarts", "autorestart_datetime")
+            restart_on_crash = config.get_bool("Restarts", "restart_on_crash")
+
+            do_backups = config.get_bool("Backups", "backup")
+            max_backups = config.get_int("Backups", "max_backups")
+            backup_schedule = config.get_schedule("Backups", "backup_datetime")
+            backup_directory = os.path.join(self.server_directory, config.get("Backups", "backup_folder"))
+            backup_mode = config.get("Backups", "backup_mode").lower()
+            if backup_mode not in self._BACKUP_MODES:
+                raise ValueError(f"Unknown backup_mode {backup_mode}, expected one of {', '.join(self._BACKUP_MODES)}")
+            archive_format = config.get("Backups", "archive_format").lower()
+            if archive_format not in backups.ARCHIVE_FORMATS:
+                raise ValueError(f"Unknown archive_format {archive_format}, expected one of {', '.join(backups.ARCHIVE_FORMATS)}")
+            compression_level = config.get_int("Backups", "compression_level")
+            compression_workers = config.get_int("Backups", "compression_workers")
+
+            index_logs = config.get_bool("Logs", "index_logs")
+            index_interval = config.get_float("Logs", "index_interval")
+
+            # only written if defaults were filled in for missing options
+            config.flush()
         except Exception as e:
             raise RuntimeError(f"Error reading configs for server: {e}")
 
+        # everything is valid, so it is all applied together
+        self._server_jar = server_jar
+        if not self._configs_loaded:
+            self._server_name = server_name
+        self._args = args
+        self._do_autorestart = do_autorestart
+        self._autorestart_schedule = autorestart_schedule
+        self._restart_on_crash = restart_on_crash
+        self._do_backups = do_backups
+        self._max_backups = max_backups
+        self._backup_schedule = backup_schedule
+        self._backup_directory = backup_directory
+        self._backup_mode = backup_mode
+        self._archive_format = archive_format
+        self._compression_level = compression_level
+        self._compression_workers = compression_workers
+        self._index_logs = index_logs
+        self._index_interval = index_interval
+        self._configs_loaded = True
+        if self.server != None:
+            self.server.set_command(self._server_jar, self._args)
+        self._refresh_status(backups_changed=True)
+
+    def _config_changed(self):
+        '''Applies changes to the config file while running, rescheduling restarts and backups for the new times.'''
+        try:
+            self.reload_configs()
+        except RuntimeError as e:
+            print(f"[WARNING] {e} Fix {self.config_file} to apply the changes.")
+            return
+        self._update_server_listeners("Reloaded configs")
+        if self.server_task_running():
+            self._cancel_jobs()
+            self._schedule_jobs()
+
+    def get_status(self) -> Tuple[Dict, str]:
+        '''
+        Get a snapshot of the server's state, which is only rebuilt when something in it changes (not on every call).
+
+        The snapshot has the server's "name", "motd", "status" (Online, Changing State or Offline), whether it is "running"
+        (the process is alive) and "ready", when it was "started_at" (epoch, or None), its "backups", whether a "backup_running",
+        the "last_backup" job (see BackupJob.to_dict), the "prepared_restore", and the "players" online. It must not be modified.
+
+        Return
+        ------
+        The snapshot, and a tag that changes whenever the snapshot does
+        '''
+        with self._status_lock:
+            return self._status, self._status_etag
+
+    def _refresh_status(self, backups_changed: bool = False):
+        '''Rebuilds the status snapshot, called whenever something in it may have changed.'''
+        with self._status_lock:
+            running = self.server != None and self.server.is_active()
+            ready = self.server_active()
+            if ready:
+                status = "Online"
+            elif self.server_should_be_running():
+                status = "Changing State"
+            else:
+                status = "Offline"
+            if backups_changed or self._status == None:
+                backup_list = sorted(self.list_backups())
+            else:
+                backup_list = self._status["backups"]
+            with self._backup_lock:
+                backup_running = self._backup_job != None and not self._backup_job.is_finished()
+                finished = [job for job in self._backup_jobs.values() if job.kind == "backup" and job.is_finished()]
+            snapshot = {
+                "name": self.get_name(),
+                "motd": self._motd,
+                "status": status,
+                "running": running,
+                "ready": ready,
+                "started_at": self._server_start_time if self.server_task_running() else None,
+                "backups": backup_list,
+                "backup_running": backup_running,
+                "last_backup": finished[-1].to_dict() if len(finished) > 0 else None,
+                "prepared_restore": self._prepared_restore,
+                "players": self.events.players(),
+            }
+            if snapshot != self._status:
+                self._status = snapshot
+                self._status_etag = hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:16]
+
+    def get_metrics(self) -> Dict:
+        '''
+        Get numbers for monitoring the server (see server.metrics): the "pid" of its process (None if it isn't running),
+        how many "console_lines" it has output in total, the "listener_backlogs" (see ServerRunner.listener_backlogs),
+        the "boot_seconds" its last start took, how many "restarts" (manual or scheduled) and "crash_restarts" there have been,
+        and the "backup_seconds" and "backup_bytes" of the last finished backup. Anything unknown is None.
+        '''
+        server = self.server
+        with self._backup_lock:
+            finished = [job for job in self._backup_jobs.values()
+                        if job.kind == "backup" and job.state == "completed" and job.started_at != None]
+        last_backup = finished[-1] if len(finished) > 0 else None
+        return {
+            "pid": server.pid() if server != None else None,
+            "console_lines": self.console.next_seq - 1,
+            "listener_backlogs": server.listener_backlogs() if server != None else [],
+            "boot_seconds": server.boot_seconds if server != None else None,
+            "restarts": self._restarts,
+            "crash_restarts": self._crash_restarts,
+            "backup_seconds": last_backup.finished_at - last_backup.started_at if last_backup != None else None,
+            "backup_bytes": last_backup.bytes_done if last_backup != None else None,
+        }
+
     def uptime(self) -> int:
         '''Get the time the server has been running since it was last started, in seconds.'''
-        if (self.server_thread_running()):
+        if (self.server_task_running()):
             return self._get_current_time() - self._server_start_time
         return 0
 
@@ -290,10 +731,18 @@ class ServerManager:
         else:
             return os.path.basename(self.server_directory)
 
-    def get_latest_log(self) -> List[str]:
-        '''Get a list of all console logs for the latest server session.'''
-        try:
-            log_file = open(os.path.join(self.server_directory, "logs", "latest.log"), "r")
-        except IOError:
-            return "No latest log found."
-        return log_file.readlines()
+    @timed("manager.get_latest_log")
+    def get_latest_log(self, lines: int = 1000) -> List[str]:
+        '''Get the last lines of the console log for the latest server session.'''
+        latest_log, _ = self._log_reader.tail(lines)
+        if len(latest_log) == 0 and self._log_reader.size() == 0:
+            return ["No latest log found."]
+        return latest_log
+
+    def search_logs(self, query: str = "", start: float = None, end: float = None, limit: int = 100) -> List[Dict]:
+        '''
+        Search the server's current and rotated logs, newest lines first (see LogIndex.search).
+
+        Only lines indexed so far are found, which lags the log by up to index_interval seconds.
+        '''
+        return self.log_index.search(query, start, end, limit)
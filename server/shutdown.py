@@ -0,0 +1,39 @@
+from server.server_manager import ServerManager
+from server.supervisor import ServerSupervisor, get_supervisor
+from typing import Dict, Iterable, List, Tuple
+import asyncio
+import time
+
+
+def shutdown_servers(managers: Iterable[ServerManager], stop_timeout: float = 30, save_timeout: float = 300,
+                     kill_timeout: float = 10, supervisor: ServerSupervisor = None) -> Dict[str, Tuple[str, float]]:
+    '''
+    Stops every server at once, waiting for them all to exit and killing any that won't (see ServerManager.stop_and_wait).
+
+    Blocks until every server has exited or been given up on, so must not be called from the supervisor's loop.
+
+    Return
+    ------
+    The outcome and how many seconds it took for each server, by name
+    '''
+    if supervisor == None:
+        supervisor = get_supervisor()
+    managers = list(managers)
+    if len(managers) == 0:
+        return {}
+    results = supervisor.submit(_shutdown_all(managers, stop_timeout, save_timeout, kill_timeout)).result()
+    return {manager.get_name(): result for manager, result in zip(managers, results)}
+
+
+async def _shutdown_all(managers: List[ServerManager], stop_timeout: float, save_timeout: float,
+                        kill_timeout: float) -> List[Tuple[str, float]]:
+    return await asyncio.gather(*(_shutdown(manager, stop_timeout, save_timeout, kill_timeout) for manager in managers))
+
+
+async def _shutdown(manager: ServerManager, stop_timeout: float, save_timeout: float, kill_timeout: float) -> Tuple[str, float]:
+    started = time.monotonic()
+    try:
+        outcome = await manager.stop_and_wait(stop_timeout, save_timeout, kill_timeout)
+    except Exception as e:
+        outcome = f"failed ({e})"
+    return outcome, time.monotonic() - started
@@ -0,0 +1,95 @@
+from server.scheduler import Scheduler
+from concurrent.futures import Future
+from typing import Awaitable
+import threading
+import asyncio
+
+
+class ServerSupervisor:
+    '''
+    Owns a single event loop, on its own thread, that every server process and monitor runs on.
+
+    All of the methods are safe to call from any thread.
+    The loop thread is started on first use.
+    '''
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+        self._scheduler = Scheduler(self)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        '''The event loop that servers are run on.'''
+        return self._loop
+
+    @property
+    def scheduler(self) -> Scheduler:
+        '''The timer that restarts, backups, and other timed jobs for every server are scheduled on.'''
+        return self._scheduler
+
+    def start(self):
+        '''Starts the loop thread if it isn't running already.'''
+        with self._lock:
+            if self._thread == None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run_loop, name="ServerSupervisor", daemon=True)
+                self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def in_loop(self) -> bool:
+        '''Returns true if called from the supervisor's loop thread.'''
+        return threading.current_thread() == self._thread
+
+    def submit(self, coro: Awaitable) -> Future:
+        '''Schedules a coroutine on the loop, returning a concurrent future for its result.'''
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call_soon(self, callback, *args):
+        '''Schedules a callback to be run on the loop.'''
+        self.start()
+        if self.in_loop():
+            self._loop.call_soon(callback, *args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def shutdown(self, timeout: float = 5):
+        '''
+        Waits up to timeout seconds for outstanding tasks to finish, cancels the rest, and stops the loop.
+
+        Must not be called from the loop thread.
+        '''
+        if self._thread == None or not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._drain(timeout)).result()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    async def _drain(self, timeout: float):
+        self._scheduler.close()
+        tasks = [task for task in asyncio.all_tasks() if task != asyncio.current_task()]
+        if len(tasks) == 0:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+_supervisor: ServerSupervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> ServerSupervisor:
+    '''Returns the supervisor shared by every server in this process.'''
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor == None:
+            _supervisor = ServerSupervisor()
+        return _supervisor
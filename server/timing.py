@@ -0,0 +1,142 @@
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict
+import threading
+import time
+
+
+# histogram bucket upper bounds in seconds, doubling from 1 microsecond to about 67 seconds (anything longer goes in a last bucket)
+BUCKET_BOUNDS = [0.000001 * 2 ** i for i in range(27)]
+
+
+class Histogram:
+    '''Counts how long something took in buckets of doubling size, enough to estimate percentiles without keeping every time.'''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        '''Estimates a percentile as the upper bound of the bucket it falls in (never more than the longest time seen).'''
+        if self.count == 0:
+            return 0.0
+        wanted = self.count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count > 0:
+                return min(BUCKET_BOUNDS[bucket], self.max) if bucket < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count > 0 else 0.0,
+            "p50_seconds": self.percentile(50),
+            "p90_seconds": self.percentile(90),
+            "p99_seconds": self.percentile(99),
+            "max_seconds": self.max,
+        }
+
+
+_enabled = False
+_lock = threading.Lock()
+_histograms: Dict[str, Histogram] = {}
+
+
+def enable_timing(enabled: bool = True):
+    '''Turns timing on or off for the whole process, times already recorded are kept.'''
+    global _enabled
+    _enabled = enabled
+
+
+def timing_enabled() -> bool:
+    return _enabled
+
+
+def record(name: str, seconds: float):
+    '''Adds a time to the histogram with the given name (whether or not timing is on).'''
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram == None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+
+
+def timing_summaries() -> Dict[str, Dict[str, float]]:
+    '''Returns a summary of every histogram by name (see Histogram.summary), in alphabetical order.'''
+    with _lock:
+        return {name: _histograms[name].summary() for name in sorted(_histograms)}
+
+
+def reset_timings():
+    '''Forgets every time recorded.'''
+    with _lock:
+        _histograms.clear()
+
+
+class _Span:
+    __slots__ = ["_name", "_start"]
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    '''
+    Times a block of code into the histogram with the given name, when timing is on:
+        with span("backup"):
+            ...
+
+    When timing is off this returns a shared object that does nothing, so leaving spans in hot code costs next to nothing.
+    '''
+    if _enabled:
+        return _Span(name)
+    return _NO_SPAN
+
+
+def timed(name: str) -> Callable:
+    '''Decorator timing every call of a function into the histogram with the given name, when timing is on (see span).'''
+    def decorate(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
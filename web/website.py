@@ -1,9 +1,18 @@
-from flask import Flask, abort, flash, redirect, render_template, session, request
+from flask import Flask, Response, abort, flash, g, jsonify, redirect, render_template, send_file, session, request
+from server.backup_coordinator import get_coordinator
 from server.server_manager import ServerManager
-from config.configs import ObsidiaConfigParser
+from server.registry import ServerRegistry
+from server.metrics import render_metrics
+from server.timing import enable_timing, record, reset_timings, timed, timing_enabled, timing_summaries
+from server.profiling import get_profiler
+from server.console import ConsoleBuffer
+from config.configs import get_config
+from server import backups
 from flask_mobility import Mobility
 from datetime import datetime
-from typing import List, Set
+from typing import Callable, Dict, Iterator, List, Tuple
+import hashlib
+import hmac
 import time
 import uuid
 import os
@@ -11,10 +20,17 @@ import os
 
 login_code = str(uuid.uuid4()) + "extras"
 
-site_configs = ObsidiaConfigParser(os.path.join("config", "obsidia_website.conf"))
-online = site_configs.get("Website", "internet").lower() == "true"
-web_port = int(site_configs.get("Website", "port"))
+site_configs = get_config(os.path.join("config", "obsidia_website.conf"))
+online = site_configs.get_bool("Website", "internet")
+web_port = site_configs.get_int("Website", "port")
 server_password = site_configs.get("Website", "password")
+console_lines = site_configs.get_int("Website", "console_lines")
+web_server = site_configs.get("Website", "web_server").lower()
+web_threads = site_configs.get_int("Website", "web_threads")
+metrics_token = site_configs.get("Website", "metrics_token")
+timings = site_configs.get_bool("Website", "timings")
+profile_max_seconds = site_configs.get_float("Website", "profile_max_seconds")
+site_configs.flush()
 
 app = Flask(__name__, static_folder=os.path.join("pages", "static"), template_folder="pages")
 mobility = Mobility(app)
@@ -71,13 +87,15 @@ def server():
             return redirect("/serverlist")
         elif session["serverselection"] == None:
             abort(404)
+        elif get_selected_manager() == None:  # the server was removed
+            return redirect("/serverlist")
         else:
             if request.MOBILE:
                 return render_template("server_mobile.html")
             else:
                 return render_template("server.html")
     elif request.method == "POST":
-        manager = get_manager(session["serverselection"])
+        manager = get_selected_manager()
         selection = request.form.get("statusbutton", default=None)
         if selection != None:
             if selection == "stop" and manager.server_should_be_running():
@@ -89,17 +107,111 @@ def server():
         else:
             command = request.form.get("commandentry", default=None)
             manager.write(command)
-            time.sleep(1)
         return redirect("/server")
 
 
+@app.route("/server/command", methods=["POST"])
+def server_command():
+    '''Sends a command to the selected server without reloading the page, the output arrives through /server/stream.'''
+    if not Login.check_login(session) or get_selected_manager() == None:
+        abort(404)
+    command = request.form.get("commandentry", default="")
+    if command.strip() == "":
+        return "", 400
+    manager = get_selected_manager()
+    if manager.server == None:
+        return "", 409
+    manager.write(command)
+    return "", 204
+
+
+# how long a console stream waits for output before sending a keepalive, which is also how closed streams are noticed
+STREAM_KEEPALIVE = 15
+
+
+@app.route("/server/stream")
+def server_stream():
+    '''
+    Streams console lines of the selected server as Server-Sent Events, each with its sequence number as the event ID.
+
+    Starts after the sequence number in the Last-Event-ID header (sent by browsers when reconnecting) or the after argument.
+    '''
+    if not Login.check_login(session) or get_selected_manager() == None:
+        abort(404)
+    console = get_selected_manager().console
+    after = request.headers.get("Last-Event-ID", default=request.args.get("after", default=None))
+    try:
+        after = int(after) if after != None else console.next_seq - 1
+    except ValueError:
+        abort(400)
+    response = Response(stream_console(console, after), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def stream_console(console: ConsoleBuffer, after: int) -> Iterator[str]:
+    '''Yields server-sent events for console lines after the given sequence number, until the client disconnects.'''
+    while True:
+        lines, last = console.wait_after(after, timeout=STREAM_KEEPALIVE, limit=console_lines)
+        if len(lines) == 0:
+            yield ": keepalive\n\n"
+            continue
+        # one event per batch keeps bursts of output cheap, the browser splits it back into lines
+        yield f"id: {last}\n" + "".join(f"data: {line}\n" for line in lines) + "\n"
+        after = last
+
+
+# the most lines a log search returns
+SEARCH_LIMIT = 1000
+
+
+@app.route("/server/search")
+def server_search():
+    '''
+    Searches the selected server's logs, reporting matching lines newest first as JSON.
+
+    Takes the words to look for as q, an optional time range as start and end (epoch seconds or ISO dates like 2023-05-01T12:00),
+    and how many lines to return as limit.
+    '''
+    if not Login.check_login(session) or get_selected_manager() == None:
+        abort(404)
+    try:
+        start = parse_time(request.args.get("start", default=""))
+        end = parse_time(request.args.get("end", default=""))
+        limit = min(int(request.args.get("limit", default=100)), SEARCH_LIMIT)
+    except ValueError:
+        abort(400)
+    lines = get_selected_manager().search_logs(request.args.get("q", default=""), start, end, limit)
+    return jsonify({"lines": lines})
+
+
+def parse_time(value: str) -> float:
+    '''Converts epoch seconds or an ISO date (in local time) to epoch seconds, None if value is blank. Raises ValueError if invalid.'''
+    value = value.strip()
+    if value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
 @app.route("/backup", methods=["GET", "POST"])
 def backup():
     if request.method == "POST":
-        manager = get_manager(session["serverselection"])
+        manager = get_selected_manager()
         selection = request.form.get("backupbutton")
         if selection == "backup":
-            manager.backup_world()
+            manager.start_backup()
+        elif selection == "verify":
+            backup = request.form.get("restoreselection")
+            if backup != None:
+                manager.start_verify(backup)
+        elif selection == "prepare":
+            backup = request.form.get("restoreselection")
+            if backup != None:
+                manager.start_prepare_restore(backup)
         elif selection == "restore":
             try:
                 backup = request.form.get("restoreselection")
@@ -112,6 +224,174 @@ def backup():
         abort(404)
 
 
+@app.route("/backup/status")
+@app.route("/backup/status/<job_id>")
+def backup_status(job_id: str = None):
+    '''Reports the progress of a backup job (the latest one if no ID is given) as JSON.'''
+    if not Login.check_login(session) or get_selected_manager() == None:
+        abort(404)
+    job = get_selected_manager().get_backup_job(job_id)
+    if job == None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route("/backup/metrics")
+def backup_metrics():
+    '''Reports how many backups are running and queued, and how long they spend queued versus copying, as JSON.'''
+    if not Login.check_login(session):
+        abort(404)
+    return jsonify(get_coordinator().metrics())
+
+
+@app.route("/metrics")
+def metrics():
+    '''
+    Reports resource usage and activity of every server and of Obsidia itself, in the Prometheus text format.
+
+    Scrapers can't log in, so this also accepts an "Authorization: Bearer <metrics_token>" header if a token is configured.
+    '''
+    if not Login.check_login(session) and not has_metrics_token():
+        abort(404)
+    return Response(render_metrics(registry), mimetype="text/plain; version=0.0.4")
+
+
+def has_metrics_token() -> bool:
+    if metrics_token == "":
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", default=""), f"Bearer {metrics_token}")
+
+
+@app.before_request
+def start_request_timer():
+    if timing_enabled():
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def stop_request_timer(response: Response) -> Response:
+    started = g.get("request_started")
+    if started != None:
+        # streamed responses are only timed until they start streaming
+        record(f"web.{request.endpoint}", time.perf_counter() - started)
+    return response
+
+
+@app.route("/admin/timings", methods=["GET", "POST"])
+def admin_timings():
+    '''
+    Reports how long the instrumented parts of Obsidia take (see server.timing) as JSON.
+
+    POST with timing set to enable, disable or reset to turn timing on or off, or forget what has been recorded.
+    '''
+    if not Login.check_login(session):
+        abort(404)
+    if request.method == "POST":
+        action = request.form.get("timing", default="")
+        if action == "enable":
+            enable_timing(True)
+        elif action == "disable":
+            enable_timing(False)
+        elif action == "reset":
+            reset_timings()
+        else:
+            abort(400)
+    return jsonify({"enabled": timing_enabled(), "timings": timing_summaries()})
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    '''
+    Reports the state of the profiler as JSON (see Profiler.status).
+
+    POST with seconds and mode (sample or cprofile) to start a profile, the result can be downloaded from /admin/profile/download.
+    '''
+    if not Login.check_login(session):
+        abort(404)
+    profiler = get_profiler()
+    if request.method == "POST":
+        try:
+            seconds = float(request.form.get("seconds", default="30"))
+            if seconds <= 0 or seconds > profile_max_seconds:
+                raise ValueError(f"seconds must be between 0 and {profile_max_seconds}")
+            profiler.start(seconds, request.form.get("mode", default="sample"))
+        except ValueError:
+            abort(400)
+        except RuntimeError:
+            return jsonify(profiler.status()), 409
+        return jsonify(profiler.status()), 202
+    return jsonify(profiler.status())
+
+
+@app.route("/admin/profile/download")
+def admin_profile_download():
+    '''Downloads the last finished profile.'''
+    if not Login.check_login(session):
+        abort(404)
+    profile_file = get_profiler().result_file()
+    if profile_file == None:
+        abort(404)
+    return send_file(profile_file, as_attachment=True)
+
+
+@app.route("/api/servers")
+def api_servers():
+    '''Reports the status of every server as JSON, see ServerManager.get_status.'''
+    if not Login.check_login(session):
+        abort(404)
+    statuses = [manager.get_status() for manager in registry]
+    etag = hashlib.sha1(",".join(tag for _, tag in statuses).encode()).hexdigest()[:16]
+    return conditional_json(etag, lambda: {"servers": [with_uptime(status) for status, _ in statuses]})
+
+
+@app.route("/api/servers/<name>")
+def api_server(name: str):
+    '''Reports the status of one server as JSON, see ServerManager.get_status.'''
+    if not Login.check_login(session):
+        abort(404)
+    manager = get_manager(name)
+    if manager == None:
+        abort(404)
+    status, etag = manager.get_status()
+    return conditional_json(etag, lambda: with_uptime(status))
+
+
+@app.route("/api/servers/<name>/events")
+def api_server_events(name: str):
+    '''
+    Reports the events seen in a server's console as JSON: a summary (see ServerEvents.summary), and time series of players online,
+    joins, lag, exceptions and saves (see ServerEvents.series), from the since argument (epoch) if given.
+    '''
+    if not Login.check_login(session):
+        abort(404)
+    manager = get_manager(name)
+    if manager == None:
+        abort(404)
+    try:
+        since = float(request.args["since"]) if "since" in request.args else None
+    except ValueError:
+        abort(400)
+    return jsonify({"summary": manager.events.summary(), "series": manager.events.series(since)})
+
+
+def conditional_json(etag: str, build: Callable[[], Dict]) -> Response:
+    '''Responds with 304 Not Modified if the client already has this etag, otherwise with the JSON that build returns.'''
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    # weak, since uptime changes without the status changing
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def with_uptime(status: Dict) -> Dict:
+    '''Adds the current uptime in seconds to a status snapshot.'''
+    started_at = status["started_at"]
+    return dict(status, uptime=int(time.time()) - started_at if started_at != None else 0)
+
+
 @app.route("/error_restoredbackupwhenrunning")
 def error_restore():
     if not Login.check_login(session):
@@ -126,38 +406,68 @@ def error_404(error):
 
 
 def get_manager(server_name: str) -> ServerManager:
-    '''Return the manager of the given server name.'''
-    for server in server_handlers:
-        if server.__str__() == server_name:
-            return server.manager
+    '''Return the manager of the given server name, or None if there is no such server.'''
+    return registry.get(server_name)
+
+
+def get_selected_manager() -> ServerManager:
+    '''Return the manager of the server selected in this session (or None), looked up once per request.'''
+    if "selected_manager" not in g:
+        g.selected_manager = registry.get(session.get("serverselection"))
+    return g.selected_manager
 
 
-def get_server_list() -> Set[ServerManager]:
-    return server_handlers
+@timed("template.get_server_list")
+def get_server_list() -> List[str]:
+    return registry.names()
 
 
 def get_server_name() -> str:
-    manager = get_manager(session["serverselection"])
+    manager = get_selected_manager()
     return manager.get_name()
 
 
-def get_server_log() -> List[str]:
-    manager = get_manager(session["serverselection"])
-    return manager.get_latest_log()
+@timed("template.get_server_log")
+def get_server_log() -> Tuple[List[str], int]:
+    '''
+    The last lines of the console, and the sequence number of the last one for the console stream to start after.
 
+    Both come from the console buffer, so the stream carries on exactly where the page left off. If the buffer is empty (the
+    server hasn't output anything since Obsidia started) the tail of latest.log is shown instead.
+    '''
+    manager = get_selected_manager()
+    lines, last = manager.console.tail(console_lines)
+    if len(lines) == 0:
+        lines = manager.get_latest_log(console_lines)
+    return lines, last
 
+
+@timed("template.get_server_status")
 def get_server_status() -> str:
-    manager = get_manager(session["serverselection"])
-    if manager.server_active():
-        return "Online"
-    elif manager.server_should_be_running():
-        return "Changing State"
-    return "Offline"
+    manager = get_selected_manager()
+    return manager.get_status()[0]["status"]
+
 
+# how far back the server page looks for lag warnings, in seconds
+ACTIVITY_WINDOW = 900
 
+
+@timed("template.get_server_activity")
+def get_server_activity() -> str:
+    '''Describe who is online and how far behind the server has fallen recently, from the events in its console.'''
+    manager = get_selected_manager()
+    players = manager.get_status()[0]["players"]
+    activity = f"{len(players)} player{'s' if len(players) != 1 else ''} online"
+    lag = [value for _, value in manager.events.series(time.time() - ACTIVITY_WINDOW)["lag_ms"] if value != None]
+    if len(lag) > 0:
+        activity += f", up to {max(lag):.0f}ms behind in the last {ACTIVITY_WINDOW // 60} minutes"
+    return activity
+
+
+@timed("template.get_backup_list")
 def get_backup_list() -> List[str]:
-    manager = get_manager(session["serverselection"])
-    return manager.list_backups()
+    manager = get_selected_manager()
+    return manager.get_status()[0]["backups"]
 
 
 def epoch_to_human(epoch: int) -> str:
@@ -168,15 +478,70 @@ def epoch_to_human(epoch: int) -> str:
         return epoch
 
 
+def format_bytes(size: int) -> str:
+    '''Convert a number of bytes to a human readable size, like 1.5 GB.'''
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+@timed("template.describe_backup")
+def describe_backup(backup: str) -> str:
+    '''Convert a backup name to its creation time, with the size and compression ratio of archives.'''
+    timestamp = backups.backup_timestamp(backup)
+    description = epoch_to_human(timestamp) if timestamp != None else backup
+    info = get_selected_manager().get_backup_info(backup)
+    if info.get("stored_bytes", 0) > 0:
+        description += f" ({format_bytes(info['stored_bytes'])}, {info['bytes'] / info['stored_bytes']:.1f}x)"
+    return description
+
+
+@timed("template.get_backup_progress")
+def get_backup_progress() -> str:
+    '''Describe the latest backup job, or an empty string if there is none.'''
+    job = get_selected_manager().get_backup_job()
+    if job == None:
+        return ""
+    action = "Backup" if job.kind == "backup" else "Verify"
+    if job.state == "failed":
+        return f"{action} failed: {job.error}"
+    if job.state == "queued":
+        return f"{action} queued behind other servers"
+    if job.state == "completed" and job.kind == "verify":
+        problems = len(job.result["missing"]) + len(job.result["corrupt"])
+        if problems == 0:
+            return f"Verified {describe_backup(job.backup)}: all {job.result['checked']} files intact"
+        return f"Verified {describe_backup(job.backup)}: {len(job.result['missing'])} missing, {len(job.result['corrupt'])} corrupt"
+    if job.state != "running":
+        return f"{action} {job.state}"
+    percent = 100 * job.bytes_done / job.bytes_total if job.bytes_total > 0 else 0
+    eta = job.eta()
+    return f"{'Backing up' if job.kind == 'backup' else 'Verifying'}: {percent:.0f}%" + (f", {eta:.0f}s left" if eta != None else "")
+
+
+@timed("template.get_prepared_restore")
+def get_prepared_restore() -> str:
+    '''Describe the backup that is ready to be swapped in, or an empty string if there is none.'''
+    backup = get_selected_manager().get_prepared_restore()
+    return describe_backup(backup) if backup != None else ""
+
+
 @app.context_processor
 def inject_load():
     symbols = dict()
     symbols["get_server_list"] = get_server_list
     symbols["get_server_name"] = get_server_name
     symbols["get_server_log"] = get_server_log
+    symbols["console_lines"] = console_lines
     symbols["get_server_status"] = get_server_status
+    symbols["get_server_activity"] = get_server_activity
     symbols["get_backup_list"] = get_backup_list
     symbols["epoch_to_human"] = epoch_to_human
+    symbols["describe_backup"] = describe_backup
+    symbols["get_backup_progress"] = get_backup_progress
+    symbols["get_prepared_restore"] = get_prepared_restore
     return symbols
 
 
@@ -208,14 +573,44 @@ def verify():
         return redirect("/login")
 
 
-def start(handlers):
-    global server_handlers
-    server_handlers = handlers
+def start(servers: ServerRegistry):
+    global registry
+    registry = servers
+    enable_timing(timings)
     print("Web console coming online.")
 
-    if online:
-        app.run(host="0.0.0.0", port=web_port)
+    host = "0.0.0.0" if online else "127.0.0.1"
+    if web_server == "waitress":
+        try:
+            serve_waitress(host)
+        except ImportError:
+            print("[WARNING] waitress is not installed (pip install waitress), using the threaded server instead.")
+            serve_threaded(host)
+    elif web_server == "development":
+        app.run(host=host, port=web_port)
     else:
-        app.run(port=web_port)
+        serve_threaded(host)
 
     print("Web console offline.")
+
+
+def serve_waitress(host: str):
+    '''Serves the app with waitress until interrupted, requests (including open console streams) share web_threads threads.'''
+    import waitress
+    print(f"Serving with waitress on {host}:{web_port} ({web_threads} threads).")
+    # console streams send keepalives, so connections are only dropped after a long silence
+    waitress.serve(app, host=host, port=web_port, threads=web_threads, connection_limit=max(100, web_threads * 2),
+                   channel_timeout=STREAM_KEEPALIVE * 4, ident="ObsidiaMC")
+
+
+def serve_threaded(host: str):
+    '''Serves the app with werkzeug's threaded server until interrupted, every connection gets its own daemon thread.'''
+    from werkzeug.serving import make_server
+    print(f"Serving on {host}:{web_port}.")
+    httpd = make_server(host, web_port, app, threaded=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()